@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""
+pcbnewの簡易スタンドイン
+ベンチマークでKiCadなしにプラグインを動かすため、プラグインが使うオブジェクトだけを再現します
+"""
+
+import itertools
+
+# レイヤー・形状・アイテム種別の定数（値はKiCad本体と一致させる必要はない）
+F_Cu = 0
+B_Cu = 2
+Edge_Cuts = 25
+F_CrtYd = 46
+B_CrtYd = 47
+
+PCB_SHAPE_T = 4
+PCB_TRACE_T = 5
+PCB_VIA_T = 6
+
+S_SEGMENT = 0
+S_RECT = 1
+S_ARC = 2
+S_CIRCLE = 3
+S_POLYGON = 4
+
+REMOVE_MODE_NORMAL = 0
+REMOVE_MODE_BULK = 1
+
+_uuid_counter = itertools.count(1)
+_current_board = None
+
+
+class VECTOR2I:
+    __slots__ = ("x", "y")
+
+    def __init__(self, x=0, y=0):
+        self.x = int(x)
+        self.y = int(y)
+
+    def __repr__(self):
+        return f"VECTOR2I({self.x}, {self.y})"
+
+
+class KIID:
+    def __init__(self):
+        self._value = f"00000000-0000-0000-0000-{next(_uuid_counter):012d}"
+
+    def AsString(self):
+        return self._value
+
+
+class ActionPlugin:
+    def __init__(self):
+        pass
+
+    def register(self):
+        pass
+
+
+class SHAPE_LINE_CHAIN:
+    def __init__(self, points):
+        self._points = list(points)
+
+    def PointCount(self):
+        return len(self._points)
+
+    def CPoint(self, index):
+        return self._points[index]
+
+
+class SHAPE_POLY_SET:
+    def __init__(self, outlines=()):
+        self._outlines = [SHAPE_LINE_CHAIN(points) for points in outlines]
+
+    def OutlineCount(self):
+        return len(self._outlines)
+
+    def Outline(self, index):
+        return self._outlines[index]
+
+
+class PCB_SHAPE:
+    """Edge.Cutsなどの図形（線分・円弧・円・矩形・ポリゴン）"""
+
+    def __init__(self, shape, layer=Edge_Cuts, start=(0, 0), end=(0, 0), center=None, radius=0, points=None):
+        self.m_Uuid = KIID()
+        self._shape = shape
+        self._layer = layer
+        self._start = VECTOR2I(*start)
+        self._end = VECTOR2I(*end)
+        self._center = VECTOR2I(*center) if center is not None else None
+        self._radius = int(radius)
+        self._poly = SHAPE_POLY_SET([[VECTOR2I(*p) for p in points]]) if points else None
+
+    def Type(self):
+        return PCB_SHAPE_T
+
+    def GetShape(self):
+        return self._shape
+
+    def GetLayer(self):
+        return self._layer
+
+    def GetStart(self):
+        return self._start
+
+    def GetEnd(self):
+        return self._end
+
+    def GetCenter(self):
+        return self._center
+
+    def GetRadius(self):
+        return self._radius
+
+    def GetPolyShape(self):
+        return self._poly
+
+
+class ZONE:
+    """ルールエリア（キープアウト）として使うゾーン"""
+
+    def __init__(self, points, name="", layer=F_Cu, rule_area=True, no_vias=True):
+        self.m_Uuid = KIID()
+        self._outline = SHAPE_POLY_SET([[VECTOR2I(*p) for p in points]])
+        self._name = name
+        self._layer = layer
+        self._rule_area = rule_area
+        self._no_vias = no_vias
+
+    def Outline(self):
+        return self._outline
+
+    def GetZoneName(self):
+        return self._name
+
+    def GetLayer(self):
+        return self._layer
+
+    def GetIsRuleArea(self):
+        return self._rule_area
+
+    def GetDoNotAllowVias(self):
+        return self._no_vias
+
+
+class FOOTPRINT:
+    """図形（コートヤードなど）だけを持つフットプリント"""
+
+    def __init__(self, reference=""):
+        self.m_Uuid = KIID()
+        self._reference = reference
+        self._items = []
+
+    def Add(self, item):
+        self._items.append(item)
+
+    def GraphicalItems(self):
+        return self._items
+
+    def GetReference(self):
+        return self._reference
+
+
+class BOARD_DESIGN_SETTINGS:
+    def __init__(self):
+        self.m_CopperEdgeClearance = 0
+        self.m_HoleToHoleMin = 250000
+
+
+class PCB_TRACK:
+    def __init__(self, start, end, width, layer=F_Cu):
+        self.m_Uuid = KIID()
+        self._start = VECTOR2I(*start)
+        self._end = VECTOR2I(*end)
+        self._width = int(width)
+        self._layer = layer
+        self._selected = False
+
+    def Type(self):
+        return PCB_TRACE_T
+
+    def IsSelected(self):
+        return self._selected
+
+    def SetSelected(self):
+        self._selected = True
+
+    def ClearSelected(self):
+        self._selected = False
+
+    def GetPosition(self):
+        return self._start
+
+    def GetStart(self):
+        return self._start
+
+    def GetEnd(self):
+        return self._end
+
+    def GetWidth(self):
+        return self._width
+
+    def GetLayer(self):
+        return self._layer
+
+
+class PCB_VIA(PCB_TRACK):
+    def __init__(self, position, width, drill=None, top=F_Cu, bottom=B_Cu, netname=""):
+        super().__init__(position, position, width, top)
+        self._drill = int(drill if drill is not None else width // 2)
+        self._top = top
+        self._bottom = bottom
+        self._netname = netname
+
+    def Type(self):
+        return PCB_VIA_T
+
+    def SetPosition(self, position):
+        self._start = self._end = position
+
+    def SetWidth(self, width):
+        self._width = int(width)
+
+    def GetDrillValue(self):
+        return self._drill
+
+    def TopLayer(self):
+        return self._top
+
+    def BottomLayer(self):
+        return self._bottom
+
+    def GetNetname(self):
+        return self._netname
+
+
+class BOARD:
+    def __init__(self, file_name=""):
+        self._tracks = []
+        self._drawings = []
+        self._zones = []
+        self._footprints = []
+        self._design_settings = BOARD_DESIGN_SETTINGS()
+        self._file_name = file_name
+
+    def Tracks(self):
+        return self._tracks
+
+    def GetDrawings(self):
+        return self._drawings
+
+    def Zones(self):
+        return self._zones
+
+    def GetFootprints(self):
+        return self._footprints
+
+    def GetDesignSettings(self):
+        return self._design_settings
+
+    def GetFileName(self):
+        return self._file_name
+
+    def Add(self, item):
+        if isinstance(item, PCB_SHAPE):
+            self._drawings.append(item)
+        elif isinstance(item, ZONE):
+            self._zones.append(item)
+        elif isinstance(item, FOOTPRINT):
+            self._footprints.append(item)
+        else:
+            self._tracks.append(item)
+
+    def Remove(self, item, mode=REMOVE_MODE_NORMAL):
+        if isinstance(item, PCB_SHAPE):
+            self._drawings.remove(item)
+        else:
+            self._tracks.remove(item)
+
+    def FinalizeBulkRemove(self, removed):
+        pass
+
+
+def GetBoard():
+    return _current_board
+
+
+def SetBoard(board):
+    """スタンドイン専用: GetBoard() が返す基板を設定"""
+    global _current_board
+    _current_board = board
+
+
+def Refresh():
+    pass
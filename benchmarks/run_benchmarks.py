@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+VIA分類プラグインのベンチマーク
+合成基板で外形線の処理・連結・フィレット・VIAの走査・VIA分類の各段階の時間とピークメモリを計測します
+--check では、各分類エンジンの結果をすべての辺・すべてのVIAの組を調べる単純な実装と比較します
+
+    python benchmarks/run_benchmarks.py --vias 1000 10000 100000
+    python benchmarks/run_benchmarks.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json --tolerance 0.5
+    python benchmarks/run_benchmarks.py --check --vias 2000 --keepouts 4 --footprints 9
+    python benchmarks/run_benchmarks.py --check --vias 2000 --notches 0 --cutouts 0
+"""
+
+import os
+import sys
+import gc
+import json
+import math
+import time
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import importlib.util
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_PATH = os.path.join(os.path.dirname(BENCH_DIR), "via-classifier-plugin.py")
+
+sys.path.insert(0, BENCH_DIR)
+import fake_pcbnew  # noqa: E402
+sys.modules["pcbnew"] = fake_pcbnew
+
+import synthetic_board  # noqa: E402
+
+# プラグインの分類コード（基準の実装用）
+VIA_INSIDE = 0
+VIA_OUTSIDE = 1
+VIA_OVERLAP = 2
+
+
+def load_plugin_module():
+    """プラグインのファイルを pcbnew スタンドインで読み込む"""
+    spec = importlib.util.spec_from_file_location("via_classifier_plugin", PLUGIN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # 並列分類のワーカープロセスに関数を渡せるように登録
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(func, repeat, memory):
+    """funcの最短実行時間と（memoryがTrueなら）ピークメモリを返す"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return best, peak, result
+
+
+def run_case(module, args, via_count):
+    """1つのVIA数について各段階を計測"""
+    board = synthetic_board.make_board(
+        via_count=via_count,
+        notches_per_edge=args.notches,
+        cutouts=args.cutouts,
+        track_count=args.tracks,
+        keepouts=args.keepouts,
+        footprints=args.footprints,
+        seed=args.seed,
+    )
+    plugin_class = module.ViaClassifierPlugin
+    snapshot = module.ViaSnapshot.from_board(board)
+    chord_tolerance = plugin_class().chord_tolerance_for(snapshot.radii)
+    results = {}
+
+    # 外形線の生成の途中結果を取り出して、連結とフィレットを単独でも計測する
+    captured = {}
+    probe = plugin_class()
+    connect_segments = probe.connect_segments_improved
+    apply_fillets = probe.apply_virtual_fillets
+
+    def capture_connect(segments):
+        captured["segments"] = segments
+        return connect_segments(segments)
+
+    def capture_fillets(points, fillet_radius):
+        captured.setdefault("contours", []).append(points)
+        return apply_fillets(points, fillet_radius)
+
+    probe.connect_segments_improved = capture_connect
+    probe.apply_virtual_fillets = capture_fillets
+    outline, _debug = probe.get_board_outline_debug(board, chord_tolerance)
+    regions, _debug = plugin_class().reference_regions(outline, board, chord_tolerance)
+    records = snapshot.records()
+
+    stages = [
+        ("outline", lambda: plugin_class().get_board_outline_debug(board, chord_tolerance)),
+        ("connect_segments", lambda: connect_segments(captured["segments"])),
+        ("virtual_fillets", lambda: [apply_fillets(points, 100000) for points in captured["contours"]]),
+        ("via_snapshot", lambda: module.ViaSnapshot.from_board(board)),
+        ("classify_vias", lambda: plugin_class().classify_vias(snapshot, outline, False)),
+        ("classify_regions", lambda: plugin_class().classify_regions(records, regions)),
+        ("via_proximity", lambda: plugin_class().analyze_via_proximity(
+            snapshot, snapshot.indices(), module.VIA_HOLE_CLEARANCE_DEFAULT)),
+    ]
+    for name, func in stages:
+        seconds, peak, _result = measure(func, args.repeat, not args.no_memory)
+        results[f"{name}@{via_count}"] = {"seconds": seconds, "peak_bytes": peak}
+
+    results[f"outline@{via_count}"]["edges"] = len(outline)
+    return results
+
+
+def reference_code(edges, x, y, radius):
+    """すべての辺を調べて1点を分類する基準の実装（O(辺数)）
+
+    外形線から半径以内なら重複、そうでなければ点より右にある交差辺の数の偶奇で内外を決める。
+    """
+    inside = False
+    for x1, y1, x2, y2 in edges:
+        C = x2 - x1
+        D = y2 - y1
+        A = x - x1
+        B = y - y1
+        len_sq = C * C + D * D
+        param = 0 if len_sq == 0 else min(1, max(0, (A * C + B * D) / len_sq))
+        if math.hypot(A - param * C, B - param * D) <= radius:
+            return VIA_OVERLAP
+        if min(y1, y2) < y <= max(y1, y2) and x <= (y - y1) * C / D + x1:
+            inside = not inside
+    return VIA_INSIDE if inside else VIA_OUTSIDE
+
+
+def reference_proximity(snapshot, indices, clearance, b_cu):
+    """X座標で並べたVIAを順に比べて、穴と穴の間隔がclearance未満の組と先のVIAを残す削除候補を求める"""
+    def span(i):
+        top, bottom = (1 << 30 if layer == b_cu else layer for layer in (snapshot.top_layers[i], snapshot.bottom_layers[i]))
+        return min(top, bottom), max(top, bottom)
+    
+    order = {i: position for position, i in enumerate(indices)}
+    by_x = sorted(indices, key=lambda i: snapshot.xs[i])
+    reach = clearance + max((snapshot.drills[i] for i in indices), default=0)
+    pairs = set()
+    for a, i in enumerate(by_x):
+        for j in by_x[a + 1:]:
+            if snapshot.xs[j] - snapshot.xs[i] > reach:
+                break
+            distance = math.hypot(snapshot.xs[j] - snapshot.xs[i], snapshot.ys[j] - snapshot.ys[i])
+            (low_i, high_i), (low_j, high_j) = span(i), span(j)
+            if (distance < (snapshot.drills[i] + snapshot.drills[j]) / 2 + clearance
+                    and max(low_i, low_j) < min(high_i, high_j)):
+                pairs.add((i, j) if order[i] < order[j] else (j, i))
+    partners = {}
+    for i, j in pairs:
+        partners.setdefault(j, []).append(i)
+    removable = []
+    removed = set()
+    for i in indices:
+        if any(j not in removed for j in partners.get(i, ())):
+            removed.add(i)
+            removable.append(i)
+    return pairs, removable
+
+
+def overlap_probes(regions, width):
+    """重なる・接する外形線（コートヤードなど）の共通部分の中心とその上下左右に置くVIAレコード
+
+    外接矩形が交わる外形線の組ごとに、共通部分の中心と、そこから半径より少し離れた4点に置く。
+    """
+    probes = []
+    for region in regions:
+        boxes = [(min(part.xs), min(part.ys), max(part.xs), max(part.ys)) for part in region.parts]
+        for i, first in enumerate(boxes):
+            for second in boxes[i + 1:]:
+                x1, y1 = max(first[0], second[0]), max(first[1], second[1])
+                x2, y2 = min(first[2], second[2]), min(first[3], second[3])
+                if x1 > x2 or y1 > y2:
+                    continue
+                cx, cy = (x1 + x2) // 2, (y1 + y2) // 2
+                step = width // 2 + 1
+                for dx, dy in ((0, 0), (-step, 0), (step, 0), (0, -step), (0, step)):
+                    probes.append((f"probe-{len(probes)}", cx + dx, cy + dy, width))
+    return probes
+
+
+def check_stream_reader(module, board, records, expected, chord_tolerance, unsupported_curves=2):
+    """read_board_fileの結果をpcbnewでの読込（collect_edge_shapes・ViaSnapshot）と比べ、不一致の数を返す
+
+    図形は種類と座標を比べ（レイヤーは名前と番号で表し方が異なる）、円弧の中心（ファイルの中間点から
+    求め直す）だけ数nmの差を許す。未対応の図形（gr_curve）を
+    unsupported_curves個加えて書き出し、デバッグ情報にその件数が出ることも確かめる。
+    """
+    handle, path = tempfile.mkstemp(suffix=".kicad_pcb")
+    os.close(handle)
+    try:
+        synthetic_board.write_kicad_pcb(board, path, unsupported_curves)
+        shapes, stream_records, debug_info = module.read_board_file(path)
+    finally:
+        os.remove(path)
+    plugin = module.ViaClassifierPlugin()
+    board_shapes, _debug = plugin.collect_edge_shapes(board)
+    mismatches = abs(len(shapes) - len(board_shapes)) + abs(len(stream_records) - len(records))
+    for shape, board_shape in zip(shapes, board_shapes):
+        tolerance = 10 if shape[0] == "arc" else 0
+        if shape[0] != board_shape[0] or len(shape) != len(board_shape) or any(
+                abs(a - b) > tolerance for a, b in zip(shape[2:], board_shape[2:])):
+            mismatches += 1
+    mismatches += sum(1 for record, board_record in zip(stream_records, records) if record != board_record)
+    if f"未対応の形状タイプ: {unsupported_curves}個" not in debug_info:
+        mismatches += 1
+    outline, _debug = plugin.get_outline_from_shapes(shapes, None, chord_tolerance)
+    codes = plugin.classify_via_records(stream_records, outline, complete=True)
+    return mismatches + sum(1 for code, truth in zip(codes, expected) if code != truth)
+
+
+def run_checks(module, args, via_count):
+    """1つのVIA数について各エンジンの結果を基準の実装と比べ、(検査名, 不一致の数) のリストを返す"""
+    board = synthetic_board.make_board(
+        via_count=via_count,
+        notches_per_edge=args.notches,
+        cutouts=args.cutouts,
+        keepouts=args.keepouts,
+        footprints=args.footprints,
+        seed=args.seed,
+    )
+    plugin_class = module.ViaClassifierPlugin
+    snapshot = module.ViaSnapshot.from_board(board)
+    records = snapshot.records()
+    chord_tolerance = plugin_class().chord_tolerance_for(snapshot.radii)
+    outline, _debug = plugin_class().get_board_outline_debug(board, chord_tolerance)
+    edges = outline.edges
+    expected = [reference_code(edges, x, y, width // 2) for _uuid, x, y, width in records]
+    checks = []
+    
+    # 分類エンジン（事前判定・インデックス・一括分類・距離場・スラブの代わりの帯・並列・NumPyなし）
+    # 3つ目の要素はモジュールの定数の一時的な変更で、帯はスラブの登録数の上限を0にして使わせ、
+    # 並列分類はVIA数の下限を下げて4つのワーカープロセスでチャンクに分けて分類する
+    engines = [("classify", {}, {}), ("distance_field", {"use_distance_field": True}, {}),
+               ("slab_bands", {}, {"SLAB_ENTRY_LIMIT": 0}),
+               ("parallel_processes", {"parallel_processes": True, "parallel_workers": 4}, {"PARALLEL_MIN_VIAS": 1}),
+               ("classify_without_numpy", {}, {"np": None})]
+    for name, options, constants in engines:
+        saved = {constant: getattr(module, constant) for constant in constants}
+        try:
+            for constant, value in constants.items():
+                setattr(module, constant, value)
+            plugin = plugin_class()
+            plugin.parallel_workers = 1
+            for option, value in options.items():
+                setattr(plugin, option, value)
+            codes = plugin.classify_via_records(records, outline, complete=True)
+        finally:
+            for constant, value in saved.items():
+                setattr(module, constant, value)
+        checks.append((name, sum(1 for code, truth in zip(codes, expected) if code != truth)))
+    
+    # 複数の領域（領域ごとに基準の実装で分類し、複数の外形線からなる領域はその和集合）
+    plugin = plugin_class()
+    regions, _debug = plugin.reference_regions(outline, board, chord_tolerance, module.VIA_HOLE_CLEARANCE_DEFAULT)
+    region_records = records + overlap_probes(regions, max(record[3] for record in records))
+    masks = plugin.classify_regions(region_records, regions)
+    mismatches = 0
+    for bit, region in enumerate(regions):
+        for (_uuid, x, y, width), mask in zip(region_records, masks):
+            codes = [reference_code(part.edges, x, y, width // 2 + region.clearance) for part in region.parts]
+            truth = VIA_INSIDE if VIA_INSIDE in codes else VIA_OVERLAP if VIA_OVERLAP in codes else VIA_OUTSIDE
+            if module.region_code(mask, bit) != truth:
+                mismatches += 1
+    checks.append((f"classify_regions[{len(regions)}]", mismatches))
+    
+    # ストリーミング読込（合成基板を .kicad_pcb に書き出し、pcbnewでの読込と図形・VIA・分類結果を比べる）
+    checks.append(("stream_reader", check_stream_reader(module, board, records, expected, chord_tolerance)))
+    
+    # 近接・重複するVIA（同じ位置に重ねたVIAを加えて比べる）
+    for item in list(snapshot.items[:max(1, via_count // 100)]):
+        position = item.GetPosition()
+        snapshot.append(item, item.m_Uuid.AsString() + "-copy", position.x, position.y, item.GetWidth(),
+                        item.GetDrillValue(), False, item.TopLayer(), item.BottomLayer())
+    indices = snapshot.indices()
+    proximity = plugin_class().analyze_via_proximity(snapshot, indices, module.VIA_HOLE_CLEARANCE_DEFAULT)
+    pairs, removable = reference_proximity(snapshot, indices, module.VIA_HOLE_CLEARANCE_DEFAULT,
+                                           fake_pcbnew.B_Cu)
+    found = set((i, j) for i, j, _gap in proximity.pairs)
+    checks.append(("via_proximity", len(found ^ pairs) + (proximity.removable != removable)))
+    return checks
+
+
+def compare(results, baseline, tolerance):
+    """ベースラインより tolerance（割合）以上遅い・メモリが多い段階を返す"""
+    regressions = []
+    for key, current in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for metric in ("seconds", "peak_bytes"):
+            if current.get(metric) is None or not reference.get(metric):
+                continue
+            ratio = current[metric] / reference[metric]
+            if ratio > 1 + tolerance:
+                regressions.append((key, metric, reference[metric], current[metric], ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VIA分類プラグインのベンチマーク")
+    parser.add_argument("--vias", type=int, nargs="+", default=[1000, 10000], help="VIA数（複数指定可、1k〜1M）")
+    parser.add_argument("--notches", type=int, default=10, help="外形の各辺の切り欠き数（外形線の複雑さ）")
+    parser.add_argument("--cutouts", type=int, default=4, help="基板内部の穴の数")
+    parser.add_argument("--keepouts", type=int, default=0, help="キープアウト（ルールエリア）の数")
+    parser.add_argument("--footprints", type=int, default=0, help="コートヤードを持つフットプリントの数")
+    parser.add_argument("--tracks", type=int, default=0, help="VIA以外の配線数")
+    parser.add_argument("--repeat", type=int, default=3, help="各段階の繰り返し回数（最短時間を採用）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true", help="ピークメモリを計測しない")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    parser.add_argument("--save-baseline", help="結果をベースラインとして保存するパス")
+    parser.add_argument("--baseline", help="比較するベースラインのパス")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="許容する悪化の割合（0.25 = 25%%）")
+    parser.add_argument("--check", action="store_true",
+                        help="計測の代わりに、各エンジンの結果を基準の実装（O(VIA数×辺数)）と比べる")
+    args = parser.parse_args(argv)
+
+    module = load_plugin_module()
+    if args.check:
+        failed = False
+        for via_count in args.vias:
+            for name, mismatches in run_checks(module, args, via_count):
+                print(f"{name + '@' + str(via_count):<36}{'ok' if mismatches == 0 else f'不一致 {mismatches}件'}")
+                failed = failed or mismatches > 0
+        return 1 if failed else 0
+    results = {}
+    for via_count in args.vias:
+        results.update(run_case(module, args, via_count))
+
+    print(f"{'stage':<28}{'seconds':>12}{'peak MiB':>12}")
+    for key, value in results.items():
+        peak = "-" if value["peak_bytes"] is None else f"{value['peak_bytes'] / (1 << 20):.2f}"
+        print(f"{key:<28}{value['seconds']:>12.4f}{peak:>12}")
+
+    report = {
+        "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                    "numpy": module.np is not None},
+        "results": results,
+    }
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        for key, metric, reference, current, ratio in regressions:
+            print(f"悪化: {key} {metric} {reference:.6g} -> {current:.6g} ({ratio:.2f}倍)", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
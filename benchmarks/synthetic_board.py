@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+"""
+ベンチマーク用の合成基板ジェネレーター
+外形（角の円弧・切り欠き）、穴（円・矩形）、キープアウト、コートヤード、VIA数、配線数を指定して
+fake_pcbnew の基板を作成します
+"""
+
+import math
+import random
+
+import fake_pcbnew as pcbnew
+
+MM = 1000000  # KiCad内部単位（nm）
+
+
+def _notched_edge(start, end, notches, depth, inward):
+    """start→endの直線に矩形の切り欠きを等間隔に入れた点列（始点を含み終点を含まない）"""
+    (x1, y1), (x2, y2) = start, end
+    points = [start]
+    if notches <= 0:
+        return points
+    length = math.hypot(x2 - x1, y2 - y1)
+    ux, uy = (x2 - x1) / length, (y2 - y1) / length
+    nx, ny = inward
+    pitch = length / (notches + 1)
+    width = pitch / 2
+    for i in range(1, notches + 1):
+        center = pitch * i
+        a = center - width / 2
+        b = center + width / 2
+        p1 = (x1 + ux * a, y1 + uy * a)
+        p2 = (p1[0] + nx * depth, p1[1] + ny * depth)
+        p4 = (x1 + ux * b, y1 + uy * b)
+        p3 = (p4[0] + nx * depth, p4[1] + ny * depth)
+        points.extend((p1, p2, p3, p4))
+    return points
+
+
+def make_outline(board, width, height, corner_radius=0, notches_per_edge=0, notch_depth=2 * MM):
+    """角を円弧で丸め、各辺に切り欠きを入れた外形をEdge.Cutsに追加"""
+    r = corner_radius
+    # 上辺・右辺・下辺・左辺（時計回り、Y軸は下向き）と内向きの法線
+    edges = [
+        ((r, 0), (width - r, 0), (0, 1)),
+        ((width, r), (width, height - r), (-1, 0)),
+        ((width - r, height), (r, height), (0, -1)),
+        ((0, height - r), (0, r), (1, 0)),
+    ]
+    # 各角の円弧の中心と開始角度（KiCadの弧は角度が増える向き）
+    corners = [
+        ((width - r, r), -90),
+        ((width - r, height - r), 0),
+        ((r, height - r), 90),
+        ((r, r), 180),
+    ]
+    for (start, end, inward), (center, angle) in zip(edges, corners):
+        points = _notched_edge(start, end, notches_per_edge, notch_depth, inward) + [end]
+        for a, b in zip(points, points[1:]):
+            board.Add(pcbnew.PCB_SHAPE(pcbnew.S_SEGMENT, start=a, end=b))
+        if r > 0:
+            a0 = math.radians(angle)
+            arc_start = (center[0] + r * math.cos(a0), center[1] + r * math.sin(a0))
+            arc_end = (center[0] + r * math.cos(a0 + math.pi / 2), center[1] + r * math.sin(a0 + math.pi / 2))
+            board.Add(pcbnew.PCB_SHAPE(pcbnew.S_ARC, start=arc_start, end=arc_end, center=center))
+
+
+def make_cutouts(board, width, height, count, rng):
+    """円・矩形・ポリゴンの穴を基板内部に追加"""
+    columns = max(1, int(math.ceil(math.sqrt(count))))
+    pitch_x = width / (columns + 1)
+    pitch_y = height / (columns + 1)
+    size = min(pitch_x, pitch_y) / 4
+    for i in range(count):
+        cx = pitch_x * (i % columns + 1)
+        cy = pitch_y * (i // columns + 1)
+        kind = i % 3
+        if kind == 0:
+            board.Add(pcbnew.PCB_SHAPE(pcbnew.S_CIRCLE, center=(cx, cy), radius=size))
+        elif kind == 1:
+            board.Add(pcbnew.PCB_SHAPE(pcbnew.S_RECT, start=(cx - size, cy - size), end=(cx + size, cy + size)))
+        else:
+            sides = rng.randint(5, 8)
+            points = [(cx + size * math.cos(2 * math.pi * k / sides), cy + size * math.sin(2 * math.pi * k / sides))
+                      for k in range(sides)]
+            board.Add(pcbnew.PCB_SHAPE(pcbnew.S_POLYGON, points=points))
+
+
+def make_regions(board, width, height, keepouts, footprints, rng):
+    """キープアウト（矩形のルールエリア）と、表面のコートヤード（矩形）だけを持つフットプリントを追加
+
+    3個に1個のフットプリントにはコートヤードが重なるフットプリントを、別の3個に1個には
+    コートヤードが辺で接するフットプリントを隣に置く。
+    """
+    for i in range(keepouts):
+        x, y = rng.uniform(0.1, 0.8) * width, rng.uniform(0.1, 0.8) * height
+        w, h = rng.uniform(2, 8) * MM, rng.uniform(2, 8) * MM
+        board.Add(pcbnew.ZONE([(x, y), (x + w, y), (x + w, y + h), (x, y + h)], name=f"KO{i}"))
+    columns = max(1, int(math.ceil(math.sqrt(footprints))))
+    pitch_x, pitch_y = width / (columns + 1), height / (columns + 1)
+    for i in range(footprints):
+        cx, cy = pitch_x * (i % columns + 1), pitch_y * (i // columns + 1)
+        size = min(pitch_x, pitch_y) / 3
+        footprint = pcbnew.FOOTPRINT(f"U{i + 1}")
+        footprint.Add(pcbnew.PCB_SHAPE(pcbnew.S_RECT, layer=pcbnew.F_CrtYd,
+                                       start=(cx - size, cy - size / 2), end=(cx + size, cy + size / 2)))
+        board.Add(footprint)
+        if i % 3 == 1:
+            neighbour = ((cx, cy), (cx + size * 1.5, cy + size))
+        elif i % 3 == 2:
+            neighbour = ((cx + size, cy - size / 2), (cx + size * 2, cy + size / 2))
+        else:
+            continue
+        footprint = pcbnew.FOOTPRINT(f"U{i + 1}A")
+        footprint.Add(pcbnew.PCB_SHAPE(pcbnew.S_RECT, layer=pcbnew.F_CrtYd, start=neighbour[0], end=neighbour[1]))
+        board.Add(footprint)
+
+
+def make_board(via_count=1000, width=100 * MM, height=80 * MM, corner_radius=3 * MM,
+               notches_per_edge=0, cutouts=0, track_count=0, via_widths=(400000, 600000, 800000),
+               edge_fraction=0.05, selected_fraction=0.0, keepouts=0, footprints=0, seed=0):
+    """合成基板を作成
+
+    VIAは外形の外側5%を含む範囲に一様に配置し、edge_fractionの割合だけ外形線の上に置く。
+    """
+    rng = random.Random(seed)
+    board = pcbnew.BOARD()
+    make_outline(board, width, height, corner_radius, notches_per_edge)
+    if cutouts:
+        make_cutouts(board, width, height, cutouts, rng)
+    if keepouts or footprints:
+        make_regions(board, width, height, keepouts, footprints, rng)
+
+    margin_x, margin_y = width * 0.05, height * 0.05
+    for i in range(via_count):
+        if rng.random() < edge_fraction:
+            # 上下の辺の近く
+            x = rng.uniform(corner_radius, width - corner_radius)
+            y = rng.choice((0, height)) + rng.uniform(-MM / 2, MM / 2)
+        else:
+            x = rng.uniform(-margin_x, width + margin_x)
+            y = rng.uniform(-margin_y, height + margin_y)
+        via = pcbnew.PCB_VIA((x, y), rng.choice(via_widths), netname=f"N{i % 64}")
+        if rng.random() < selected_fraction:
+            via.SetSelected()
+        board.Add(via)
+
+    for i in range(track_count):
+        x = rng.uniform(0, width)
+        y = rng.uniform(0, height)
+        board.Add(pcbnew.PCB_TRACK((x, y), (x + MM, y), 200000))
+
+    pcbnew.SetBoard(board)
+    return board
+
+
+def _mm(value):
+    """KiCad内部単位（nm）をファイル上のmm値の文字列に変換"""
+    return f"{value / MM:.6f}".rstrip("0").rstrip(".")
+
+
+def write_kicad_pcb(board, path, unsupported_curves=0):
+    """合成基板を .kicad_pcb として書き出す（ストリーミング読込とpcbnewでの読込の比較用）
+
+    Edge.Cutsの図形・VIA・配線・コートヤードを書き出す。円弧は1つおきに終点から始点の向きで書く
+    （KiCadのファイルではどちらの向きもあり得る）。unsupported_curvesの数だけ、
+    外形には使われない gr_curve（未対応の図形）をEdge.Cutsに加える。
+    """
+    lines = ['(kicad_pcb (version 20240108) (generator "synthetic_board")']
+    arcs = 0
+    for drawing in board.GetDrawings():
+        shape, layer = drawing.GetShape(), '(layer "Edge.Cuts")'
+        start, end = drawing.GetStart(), drawing.GetEnd()
+        if shape == pcbnew.S_SEGMENT:
+            lines.append(f"  (gr_line (start {_mm(start.x)} {_mm(start.y)}) (end {_mm(end.x)} {_mm(end.y)}) {layer})")
+        elif shape == pcbnew.S_RECT:
+            lines.append(f"  (gr_rect (start {_mm(start.x)} {_mm(start.y)}) (end {_mm(end.x)} {_mm(end.y)}) {layer})")
+        elif shape == pcbnew.S_CIRCLE:
+            center = drawing.GetCenter()
+            lines.append(f"  (gr_circle (center {_mm(center.x)} {_mm(center.y)}) "
+                         f"(end {_mm(center.x + drawing.GetRadius())} {_mm(center.y)}) {layer})")
+        elif shape == pcbnew.S_ARC:
+            # 始点から角度が増える向きの弧の中間点
+            center = drawing.GetCenter()
+            radius = math.hypot(start.x - center.x, start.y - center.y)
+            start_angle = math.atan2(start.y - center.y, start.x - center.x)
+            sweep = (math.atan2(end.y - center.y, end.x - center.x) - start_angle) % (2 * math.pi)
+            mid = (round(center.x + radius * math.cos(start_angle + sweep / 2)),
+                   round(center.y + radius * math.sin(start_angle + sweep / 2)))
+            if arcs % 2:
+                start, end = end, start
+            arcs += 1
+            lines.append(f"  (gr_arc (start {_mm(start.x)} {_mm(start.y)}) (mid {_mm(mid[0])} {_mm(mid[1])}) "
+                         f"(end {_mm(end.x)} {_mm(end.y)}) {layer})")
+        elif shape == pcbnew.S_POLYGON:
+            outline = drawing.GetPolyShape().Outline(0)
+            points = " ".join(f"(xy {_mm(outline.CPoint(i).x)} {_mm(outline.CPoint(i).y)})"
+                              for i in range(outline.PointCount()))
+            lines.append(f"  (gr_poly (pts {points}) {layer})")
+    for i in range(unsupported_curves):
+        lines.append(f"  (gr_curve (pts (xy {i} -10) (xy {i + 1} -12) (xy {i + 2} -12) (xy {i + 3} -10)) "
+                     f'(layer "Edge.Cuts"))')
+    for footprint in board.GetFootprints():
+        lines.append(f'  (footprint "Synthetic:{footprint.GetReference()}" (layer "F.Cu")')
+        for item in footprint.GraphicalItems():
+            start, end = item.GetStart(), item.GetEnd()
+            lines.append(f'    (fp_rect (start {_mm(start.x)} {_mm(start.y)}) (end {_mm(end.x)} {_mm(end.y)}) '
+                         f'(layer "F.CrtYd"))')
+        lines.append("  )")
+    for track in board.Tracks():
+        start, end = track.GetStart(), track.GetEnd()
+        if track.Type() == pcbnew.PCB_VIA_T:
+            lines.append(f"  (via (at {_mm(start.x)} {_mm(start.y)}) (size {_mm(track.GetWidth())}) "
+                         f'(drill {_mm(track.GetDrillValue())}) (layers "F.Cu" "B.Cu") (net 0) '
+                         f'(uuid "{track.m_Uuid.AsString()}"))')
+        else:
+            lines.append(f"  (segment (start {_mm(start.x)} {_mm(start.y)}) (end {_mm(end.x)} {_mm(end.y)}) "
+                         f'(width {_mm(track.GetWidth())}) (layer "F.Cu") (net 0))')
+    lines.append(")")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
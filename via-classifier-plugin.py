@@ -7,13 +7,1388 @@ VIA分類プラグイン（矩形対応版）
 矩形ツールで作成された外形線にも対応
 """
 
-import pcbnew
 import os
-import wx
+import re
+import sys
+import mmap
 import math
+import json
+import time
+import hashlib
+import argparse
+import platform
 import traceback  # デバッグ情報用
+import threading
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import pcbnew
+except ImportError:  # ストリーミング読込によるヘッドレス実行ではpcbnewが無くても動作する
+    pcbnew = None
+
+try:
+    import wx
+except ImportError:  # ヘッドレス実行（コマンドライン）ではwxを使わない
+    wx = None
+
+try:
+    import numpy as np  # 一括分類エンジン用（任意）
+except ImportError:
+    np = None
+
+# 分類コード
+VIA_INSIDE = 0
+VIA_OUTSIDE = 1
+VIA_OVERLAP = 2
+
+# 一括分類で一度に処理する「VIA数×辺数」の上限（一時配列のメモリを抑える）
+BATCH_CELL_LIMIT = 1 << 20
+
+# 外形線の辺数がこれ以上の場合は空間インデックスで近傍の辺だけを調べる
+INDEX_MIN_EDGES = 64
+
+# 内外判定のスラブ分割に登録する辺の延べ数の上限（穴の多い外形線では頂点のY座標の数×帯を横切る辺の数で
+# 増えるため、超える場合は一定の高さの帯に辺を登録し、帯の中の辺をすべて調べる）
+SLAB_ENTRY_LIMIT = 1 << 21
+
+# 複数の領域での分類で、領域の外接矩形を登録する格子の1辺あたりのセル数
+REGION_GRID_SIZE = 64
+
+# 外形線までの距離（結果一覧用）: 格子で近傍の辺を探す回数（検索範囲を毎回2倍にする）と、
+# 格子で見つからない場合に外接矩形でまとめる連続した辺の数
+DISTANCE_GRID_ROUNDS = 1
+EDGE_GROUP_SIZE = 16
+
+# 事前判定の格子の1辺あたりのセル数（外形線の外接矩形の長辺をこの数で分割）と、
+# 事前判定を作成する分類対象のVIA数の下限（少ない場合は作成せずにインデックスで直接分類する方が速い）
+PREFILTER_GRID_SIZE = 256
+PREFILTER_MIN_VIAS = 32768
+
+# 符号付き距離場（外形線が変わらないまま何度も分類する場合に有効化する）
+# セル幅は最小のVIA半径とし、外形線からBANDセル以内だけ距離を計算する
+DISTANCE_FIELD_ENABLED = False
+DISTANCE_FIELD_BAND = 8
+DISTANCE_FIELD_MAX_CELLS = 1 << 22
+
+# KiCadが作成した基板外形（SHAPE_POLY_SET）で分類する（使えない場合はPythonの外形線処理を使う）
+NATIVE_ENGINE_ENABLED = False
+
+# 進捗表示・キャンセル確認を行うVIA数の間隔
+PROGRESS_CHUNK = 4096
+
+# 分類が必要なVIAがこれ以上の場合はチャンクに分けて並列に分類する
+PARALLEL_MIN_VIAS = 50000
+PARALLEL_CHUNKS_PER_WORKER = 4
+
+# 近接・重複するVIAの検出: 穴と穴の間隔の最小値（設計ルールの m_HoleToHoleMin が取得できない場合）と、
+# 同じ位置（コピー&ペーストの残りなど）とみなす中心間の距離（KiCad内部単位 nm）
+VIA_HOLE_CLEARANCE_DEFAULT = 250000
+VIA_DUPLICATE_TOLERANCE = 1000
+
+# ライブモード: 基板の変更通知（BOARD_LISTENER）を使うかどうかと、タイマーと走査の最短の間隔（ミリ秒）
+# PythonからBOARD_LISTENERを継承できないビルドでは通知が届かないため、最初の通知が届くまでは基板も走査する。
+# 走査の間隔は前回の走査にかかった時間の LIVE_POLL_COST_FACTOR 倍以上空け（GUIを止める時間を抑える）、
+# LIVE_POLL_WINDOW_MS を過ぎても通知が届かなければ走査をやめてライブ更新を使えないと表示する
+LIVE_USE_LISTENER = True
+LIVE_POLL_INTERVAL_MS = 1000
+LIVE_POLL_COST_FACTOR = 20
+LIVE_POLL_WINDOW_MS = 60000
+
+# 外形線キャッシュ（外形線の生成処理を変更した場合はバージョンを上げる）
+OUTLINE_CACHE_VERSION = 3
+OUTLINE_CACHE_SIZE = 8
+OUTLINE_CACHE_PERSIST = False  # Trueで .kicad_pcb の隣にキャッシュファイルを保存
+
+# 円弧・円を線分化するときの弦の許容誤差（KiCad内部単位 nm）
+# 基板上の最小VIA半径 × ARC_CHORD_ERROR_RATIO を MIN〜MAX の範囲に制限して使う
+ARC_CHORD_ERROR_RATIO = 0.05
+ARC_CHORD_ERROR_MIN = 1000
+ARC_CHORD_ERROR_MAX = 50000
+ARC_CHORD_ERROR_DEFAULT = 5000
+
+# ストリーミング読込で対象とする .kicad_pcb の要素
+# （KiCadは要素ごとに改行し、文字列中の改行はエスケープするため、行頭の要素だけを対象にする）
+STREAM_ITEM_PATTERN = re.compile(rb"(?m)^[ \t]*(\((via|gr_line|gr_arc|gr_circle|gr_rect|gr_poly|gr_curve)[\s)])")
+STREAM_SHAPE_KINDS = ("gr_line", "gr_arc", "gr_circle", "gr_rect", "gr_poly")
+SEXPR_TOKEN_PATTERN = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+
+if pcbnew is not None:
+    Vector2 = pcbnew.VECTOR2I
+else:
+    class Vector2:
+        """pcbnewが無い環境で VECTOR2I の代わりに使う点"""
+        __slots__ = ("x", "y")
+
+        def __init__(self, x=0, y=0):
+            self.x = int(x)
+            self.y = int(y)
+
+
+class BoardOutline:
+    """閉じた輪郭の集まりとしての外形線（外周・穴・穴の中の島）
+
+    点の座標は整数の配列 xs, ys に全輪郭を続けて格納し、輪郭 i は starts[i]〜starts[i+1] の範囲。
+    各輪郭は最後の点から最初の点へ戻る辺で閉じる。
+    内外はすべての輪郭の辺に対する交差数の偶奇で決まるため、穴の中は外側、島の中は内側になる。
+    edgesは全輪郭の辺 (x1, y1, x2, y2) のリストで、インデックスの構築などで必要になった時に作る。
+    VECTOR2Iは使わず、KiCadのAPIとの受け渡しの時だけ変換する。
+    """
+
+    def __init__(self, contours=()):
+        self.xs = array("q")
+        self.ys = array("q")
+        self.starts = array("q", [0])
+        for contour in contours:
+            begin = len(self.xs)
+            for x, y in contour:
+                self.xs.append(int(x))
+                self.ys.append(int(y))
+            if len(self.xs) - begin < 2:
+                del self.xs[begin:]
+                del self.ys[begin:]
+            else:
+                self.starts.append(len(self.xs))
+        self._build()
+
+    @classmethod
+    def from_arrays(cls, xs, ys, starts):
+        """配列から直接作成（並列分類のワーカーへの受け渡し用）"""
+        outline = cls.__new__(cls)
+        outline.xs, outline.ys, outline.starts = array("q", xs), array("q", ys), array("q", starts)
+        outline._build()
+        return outline
+
+    def _build(self):
+        self._edges = None
+        self.depths = self._nesting_depths()
+
+    @property
+    def edges(self):
+        """全輪郭の辺 (x1, y1, x2, y2) のリスト（初めて使う時に作成）"""
+        if self._edges is None:
+            edges = []
+            for i in range(self.contour_count):
+                xs, ys = self._contour_arrays(i)
+                edges.extend(zip(xs, ys, xs[1:] + xs[:1], ys[1:] + ys[:1]))
+            self._edges = edges
+        return self._edges
+
+    def __len__(self):
+        return len(self.xs)
+
+    @property
+    def contour_count(self):
+        return len(self.starts) - 1
+
+    def _contour_arrays(self, i):
+        begin, end = self.starts[i], self.starts[i + 1]
+        return self.xs[begin:end], self.ys[begin:end]
+
+    def contour(self, i):
+        """輪郭 i の点 (x, y) のリスト"""
+        return list(zip(*self._contour_arrays(i)))
+
+    @property
+    def contours(self):
+        return [self.contour(i) for i in range(self.contour_count)]
+
+    def _nesting_depths(self):
+        """各輪郭を含む他の輪郭の数（0: 外周、1: 穴、2: 穴の中の島 ...）"""
+        count = self.contour_count
+        boxes = []
+        for j in range(count):
+            xs, ys = self._contour_arrays(j)
+            boxes.append((min(xs), min(ys), max(xs), max(ys)))
+        depths = []
+        for i in range(count):
+            x, y = self.xs[self.starts[i]], self.ys[self.starts[i]]
+            depth = 0
+            for j in range(count):
+                if i == j or self.starts[j + 1] - self.starts[j] < 3:
+                    continue
+                min_x, min_y, max_x, max_y = boxes[j]
+                if not (min_x <= x <= max_x and min_y <= y <= max_y):
+                    continue
+                inside = False
+                xs, ys = self._contour_arrays(j)
+                for x1, y1, x2, y2 in zip(xs, ys, xs[1:] + xs[:1], ys[1:] + ys[:1]):
+                    # (y1 < y) != (y2 < y) は min(y1, y2) < y <= max(y1, y2) と同じ
+                    if (y1 < y) != (y2 < y) and x <= max(x1, x2):
+                        if x1 == x2 or x <= (y - y1) * (x2 - x1) / (y2 - y1) + x1:
+                            inside = not inside
+                depth += inside
+            depths.append(depth)
+        return depths
+
+    def summary(self):
+        """デバッグ情報用の輪郭の内訳"""
+        holes = sum(1 for depth in self.depths if depth % 2 == 1)
+        return f"輪郭: {self.contour_count}個（外周・島 {self.contour_count - holes}個, 穴 {holes}個）\n"
+
+
+class OutlineIndex:
+    """外形線の辺を一様グリッドとスラブ分割に登録した空間インデックス
+
+    外形線ごとに一度だけ構築し、距離判定では近傍の辺だけを、内外判定では
+    スラブ（頂点のY座標で区切った帯）の二分探索で交差数を求める。スラブに登録する辺の延べ数が
+    SLAB_ENTRY_LIMIT を超える場合は、一定の高さの帯に登録した辺を順に調べる。
+    """
+
+    def __init__(self, outline, cell_size=None):
+        self.edges = edges = outline.edges
+        
+        if cell_size is None:
+            xs, ys = outline.xs, outline.ys
+            span = max(max(xs) - min(xs), max(ys) - min(ys), 1)
+            total = sum(math.hypot(x2 - x1, y2 - y1) for x1, y1, x2, y2 in edges)
+            cell_size = max(total / max(1, len(edges)), span / 2048, 1)
+        self.cell_size = cell_size
+        self.edges_tested = 0  # 診断情報用：幾何判定した辺の延べ数
+        self.edge_groups = None  # 遠い点の距離計算用（distanceで初めて使う時に作成）
+        
+        # 距離判定用の辺をグリッドに登録（セル幅以下の間隔で辺上をサンプリング）
+        self.segment_cells = {}
+        for i, (x1, y1, x2, y2) in enumerate(edges):
+            steps = int(math.hypot(x2 - x1, y2 - y1) / cell_size) + 1
+            for step in range(steps + 1):
+                t = step / steps
+                key = (int((x1 + (x2 - x1) * t) // cell_size), int((y1 + (y2 - y1) * t) // cell_size))
+                bucket = self.segment_cells.setdefault(key, [])
+                if not bucket or bucket[-1] != i:
+                    bucket.append(i)
+        
+        # 内外判定用の辺（水平な辺は交差判定に関与しない）の始点・傾き・Y座標の範囲
+        crossing = [i for i, (_x1, y1, _x2, y2) in enumerate(edges) if y1 != y2]
+        self.edge_x = array("d", (edges[i][0] for i in crossing))
+        self.edge_y = array("d", (edges[i][1] for i in crossing))
+        self.edge_slope = array("d", ((edges[i][2] - edges[i][0]) / (edges[i][3] - edges[i][1]) for i in crossing))
+        self.edge_low = array("q", (min(edges[i][1], edges[i][3]) for i in crossing))
+        self.edge_high = array("q", (max(edges[i][1], edges[i][3]) for i in crossing))
+        
+        # スラブ分割: 頂点のY座標で区切った帯 (slab_ys[s], slab_ys[s+1]] ごとに、帯を横切る辺の番号を
+        # 帯の中でのX座標の順に並べる（輪郭どうしは交差しないため帯の中で順序は変わらない）
+        self.slab_ys = sorted(set(self.edge_low) | set(self.edge_high))
+        spans = [(bisect_left(self.slab_ys, low), bisect_left(self.slab_ys, high))
+                 for low, high in zip(self.edge_low, self.edge_high)]
+        self.slabs = None
+        self.bands = None
+        if sum(last - first for first, last in spans) <= SLAB_ENTRY_LIMIT:
+            slabs = [[] for _ in range(max(0, len(self.slab_ys) - 1))]
+            for i, (first, last) in enumerate(spans):
+                for slab in range(first, last):
+                    slabs[slab].append(i)
+            edge_x, edge_y, edge_slope = self.edge_x, self.edge_y, self.edge_slope
+            for slab, slab_edges in enumerate(slabs):
+                middle = (self.slab_ys[slab] + self.slab_ys[slab + 1]) / 2
+                slab_edges.sort(key=lambda i: (middle - edge_y[i]) * edge_slope[i] + edge_x[i])
+                slabs[slab] = array("i", slab_edges)
+            self.slabs = slabs
+        elif crossing:
+            # 帯の高さは辺の高さの平均程度にする（登録数は辺の数の数倍に収まる）
+            self.band_min = self.slab_ys[0]
+            span = max(self.slab_ys[-1] - self.band_min, 1)
+            total_height = sum(high - low for low, high in zip(self.edge_low, self.edge_high))
+            count = max(1, min(len(crossing), len(crossing) * span // max(total_height, 1)))
+            self.band_height = span / count
+            bands = [[] for _ in range(count)]
+            for i, (low, high) in enumerate(zip(self.edge_low, self.edge_high)):
+                for band in range(min(int((low - self.band_min) // self.band_height), count - 1),
+                                  min(int((high - self.band_min) // self.band_height), count - 1) + 1):
+                    bands[band].append(i)
+            self.bands = [array("i", band) for band in bands]
+
+    def point_inside(self, x, y):
+        """点より右にある交差辺の数の偶奇をスラブの二分探索（または帯の中の辺）で求める"""
+        if self.slabs is None:
+            return self._point_inside_band(x, y)
+        edge_x, edge_y, edge_slope = self.edge_x, self.edge_y, self.edge_slope
+        slab = bisect_left(self.slab_ys, y) - 1
+        if slab < 0 or slab >= len(self.slabs):
+            return False
+        slab_edges = self.slabs[slab]
+        # x <= 交点のX座標 となる最初の辺（レイキャスティングと同じ式で交点を求める）
+        low, high = 0, len(slab_edges)
+        while low < high:
+            middle = (low + high) // 2
+            i = slab_edges[middle]
+            self.edges_tested += 1
+            if x <= (y - edge_y[i]) * edge_slope[i] + edge_x[i]:
+                high = middle
+            else:
+                low = middle + 1
+        return (len(slab_edges) - low) % 2 == 1
+
+    def _point_inside_band(self, x, y):
+        """スラブの代わりに、点を含む帯に登録した辺の交差数の偶奇を求める"""
+        if self.bands is None or not self.band_min < y <= self.slab_ys[-1]:
+            return False
+        band_edges = self.bands[min(int((y - self.band_min) // self.band_height), len(self.bands) - 1)]
+        self.edges_tested += len(band_edges)
+        edge_low, edge_high = self.edge_low, self.edge_high
+        edge_x, edge_y, edge_slope = self.edge_x, self.edge_y, self.edge_slope
+        inside = False
+        for i in band_edges:
+            if edge_low[i] < y <= edge_high[i] and x <= (y - edge_y[i]) * edge_slope[i] + edge_x[i]:
+                inside = not inside
+        return inside
+
+    def segments_near(self, x, y, radius):
+        """点から半径radius以内にある可能性のある辺のインデックス"""
+        cell_size = self.cell_size
+        # サンプリング間隔の半分だけ検索範囲を広げる
+        reach = radius + cell_size / 2
+        found = set()
+        for cx in range(int((x - reach) // cell_size), int((x + reach) // cell_size) + 1):
+            for cy in range(int((y - reach) // cell_size), int((y + reach) // cell_size) + 1):
+                bucket = self.segment_cells.get((cx, cy))
+                if bucket:
+                    found.update(bucket)
+        return found
+
+    def overlaps(self, x, y, radius):
+        """点から半径radius以内に外形線の辺があるか"""
+        edges = self.edges
+        candidates = self.segments_near(x, y, radius)
+        self.edges_tested += len(candidates)
+        for i in candidates:
+            x1, y1, x2, y2 = edges[i]
+            C = x2 - x1
+            D = y2 - y1
+            A = x - x1
+            B = y - y1
+            len_sq = C * C + D * D
+            param = 0 if len_sq == 0 else min(1, max(0, (A * C + B * D) / len_sq))
+            if math.hypot(A - param * C, B - param * D) <= radius:
+                return True
+        return False
+
+    def distance(self, x, y):
+        """点から最も近い辺までの距離
+
+        近くの辺は格子で探し（検索範囲を倍々に広げる）、格子で見つからない遠い点では
+        連続する辺をまとめた外接矩形を近い順に調べ、矩形までの距離が最短距離を超えたら打ち切る。
+        """
+        reach = self.cell_size
+        for _ in range(DISTANCE_GRID_ROUNDS):
+            best = self._nearest(x, y, self.segments_near(x, y, reach))
+            if best is not None and best <= reach:
+                return best
+            reach *= 2
+        
+        if self.edge_groups is None:
+            self.edge_groups = []
+            edges = self.edges
+            for start in range(0, len(edges), EDGE_GROUP_SIZE):
+                group = edges[start:start + EDGE_GROUP_SIZE]
+                self.edge_groups.append((min(min(e[0], e[2]) for e in group), min(min(e[1], e[3]) for e in group),
+                                         max(max(e[0], e[2]) for e in group), max(max(e[1], e[3]) for e in group),
+                                         start))
+        bounds = []
+        for min_x, min_y, max_x, max_y, start in self.edge_groups:
+            dx = min_x - x if x < min_x else (x - max_x if x > max_x else 0)
+            dy = min_y - y if y < min_y else (y - max_y if y > max_y else 0)
+            bounds.append((dx * dx + dy * dy, start))
+        bounds.sort()
+        best = None
+        for bound_sq, start in bounds:
+            if best is not None and bound_sq > best * best:
+                break
+            dist = self._nearest(x, y, range(start, min(start + EDGE_GROUP_SIZE, len(self.edges))))
+            if best is None or dist < best:
+                best = dist
+        return best
+
+    def _nearest(self, x, y, candidates):
+        """候補の辺のうち最も近い辺までの距離（候補が無ければNone）"""
+        edges = self.edges
+        self.edges_tested += len(candidates)
+        best = None
+        for i in candidates:
+            x1, y1, x2, y2 = edges[i]
+            C = x2 - x1
+            D = y2 - y1
+            A = x - x1
+            B = y - y1
+            len_sq = C * C + D * D
+            param = 0 if len_sq == 0 else min(1, max(0, (A * C + B * D) / len_sq))
+            dist = math.hypot(A - param * C, B - param * D)
+            if best is None or dist < best:
+                best = dist
+        return best
+
+    def classify(self, x, y, radius):
+        """1点を分類コードに変換"""
+        if self.overlaps(x, y, radius):
+            return VIA_OVERLAP
+        return VIA_INSIDE if self.point_inside(x, y) else VIA_OUTSIDE
+
+
+class OutlinePrefilter:
+    """厳密な幾何判定の前に、外形線から離れたVIAを定数時間で分類する事前判定
+
+    外接矩形からVIAの半径以上離れていれば「外側」、外接矩形を覆う格子のうち
+    外形線から十分離れたセルにあれば、そのセルの内外と外形線までの距離の下限で判定する。
+    判定できない（外形線の近くの）VIAだけを厳密判定に回す。
+    """
+
+    # 判定の段階（診断情報のカウンター名）
+    TIERS = ("prefilter_bbox", "prefilter_inside", "prefilter_outside", "distance_field", "prefilter_exact")
+
+    def __init__(self, outline, grid_size=PREFILTER_GRID_SIZE):
+        edges = outline.edges
+        xs = [e[0] for e in edges]
+        ys = [e[1] for e in edges]
+        self.min_x, self.max_x = min(xs), max(xs)
+        self.min_y, self.max_y = min(ys), max(ys)
+        cell_size = max(max(self.max_x - self.min_x, self.max_y - self.min_y) / grid_size, 1)
+        self.cell_size = cell_size
+        columns = self.columns = int((self.max_x - self.min_x) // cell_size) + 1
+        rows = self.rows = int((self.max_y - self.min_y) // cell_size) + 1
+        
+        # 外形線の辺をセル幅以下の間隔でサンプリングし、
+        # 各セルからサンプルのあるセルまでのチェビシェフ距離（セル数）を求める
+        far = columns + rows
+        steps_away = [far] * (columns * rows)
+        for x1, y1, x2, y2 in edges:
+            steps = int(math.hypot(x2 - x1, y2 - y1) / cell_size) + 1
+            for step in range(steps + 1):
+                t = step / steps
+                column = min(columns - 1, int((x1 + (x2 - x1) * t - self.min_x) // cell_size))
+                row = min(rows - 1, int((y1 + (y2 - y1) * t - self.min_y) // cell_size))
+                steps_away[row * columns + column] = 0
+        for row in range(rows):
+            for column in range(columns):
+                i = row * columns + column
+                d = steps_away[i]
+                if column > 0:
+                    d = min(d, steps_away[i - 1] + 1)
+                if row > 0:
+                    for neighbor in range(max(0, column - 1), min(columns, column + 2)):
+                        d = min(d, steps_away[i - columns - column + neighbor] + 1)
+                steps_away[i] = d
+        for row in range(rows - 1, -1, -1):
+            for column in range(columns - 1, -1, -1):
+                i = row * columns + column
+                d = steps_away[i]
+                if column < columns - 1:
+                    d = min(d, steps_away[i + 1] + 1)
+                if row < rows - 1:
+                    for neighbor in range(max(0, column - 1), min(columns, column + 2)):
+                        d = min(d, steps_away[i + columns - column + neighbor] + 1)
+                steps_away[i] = d
+        
+        # 辺はサンプルのあるセルかその隣にしか通らないため、2セル以上離れたセルは辺を含まず内外が一様で、
+        # セル内の点から外形線までの距離は (離れたセル数 - 2) × セル幅 以上になる。
+        # セルの内外は各行の中心線と辺の交点（レイキャスティングと同じ規則）から求める
+        crossings = [[] for _ in range(rows)]
+        for x1, y1, x2, y2 in edges:
+            if y1 == y2:
+                continue
+            low, high = min(y1, y2), max(y1, y2)
+            first = int(math.floor((low - self.min_y) / cell_size - 0.5)) + 1
+            last = int(math.floor((high - self.min_y) / cell_size - 0.5))
+            for row in range(max(0, first), min(rows - 1, last) + 1):
+                center_y = self.min_y + (row + 0.5) * cell_size
+                crossings[row].append((center_y - y1) * (x2 - x1) / (y2 - y1) + x1)
+        
+        # セルごとの外形線までの距離の下限（内側のセルは正、外側のセルは負、判定できないセルは0）
+        self.clearance = array("d", bytes(8 * columns * rows))
+        for row in range(rows):
+            row_crossings = sorted(crossings[row])
+            for column in range(columns):
+                i = row * columns + column
+                if steps_away[i] < 3:
+                    continue
+                center_x = self.min_x + (column + 0.5) * cell_size
+                inside = (len(row_crossings) - bisect_left(row_crossings, center_x)) % 2 == 1
+                margin = (steps_away[i] - 2) * cell_size
+                self.clearance[i] = margin if inside else -margin
+
+    def classify(self, x, y, radius):
+        """分類コード、または厳密判定が必要な場合は None と判定の段階を返す"""
+        if x + radius < self.min_x or x - radius > self.max_x or y + radius < self.min_y or y - radius > self.max_y:
+            return VIA_OUTSIDE, "prefilter_bbox"
+        column = int((x - self.min_x) // self.cell_size)
+        row = int((y - self.min_y) // self.cell_size)
+        if 0 <= column < self.columns and 0 <= row < self.rows:
+            clearance = self.clearance[row * self.columns + column]
+            # 浮動小数点の誤差を考慮して1nmの余裕をとる
+            if clearance > radius + 1:
+                return VIA_INSIDE, "prefilter_inside"
+            if -clearance > radius + 1:
+                return VIA_OUTSIDE, "prefilter_outside"
+        return None, "prefilter_exact"
+
+
+class DistanceField:
+    """外形線までの符号付き距離をセルの中心で標本化したラスター（内側が正、外側が負）
+
+    距離は外形線からband_cellsセル以内のセルだけ計算し、それより遠いセルは ±band_cells×セル幅 に丸める。
+    VIAの半径にセルの対角線の長さを加えた値より外形線から離れていれば、
+    そのVIAは外形線と重ならず、内外もセルの中心と同じになる。
+    """
+
+    def __init__(self, outline, cell_size, band_cells=DISTANCE_FIELD_BAND):
+        edges = outline.edges
+        xs = [e[0] for e in edges]
+        ys = [e[1] for e in edges]
+        band = band_cells * cell_size
+        self.min_x, self.min_y = min(xs) - band, min(ys) - band
+        width, height = max(xs) + band - self.min_x, max(ys) + band - self.min_y
+        cell_size = max(cell_size, math.sqrt(width * height / DISTANCE_FIELD_MAX_CELLS), 1)
+        band = band_cells * cell_size
+        self.cell_size = cell_size
+        self.diagonal = cell_size * math.sqrt(2)
+        columns = self.columns = int(width // cell_size) + 1
+        rows = self.rows = int(height // cell_size) + 1
+        
+        # 外形線の近くのセルは中心からすべての辺までの距離を計算
+        distance = array("d", [band]) * (columns * rows)
+        for x1, y1, x2, y2 in edges:
+            C = x2 - x1
+            D = y2 - y1
+            len_sq = C * C + D * D
+            first_column = max(0, int((min(x1, x2) - band - self.min_x) // cell_size))
+            last_column = min(columns - 1, int((max(x1, x2) + band - self.min_x) // cell_size))
+            first_row = max(0, int((min(y1, y2) - band - self.min_y) // cell_size))
+            last_row = min(rows - 1, int((max(y1, y2) + band - self.min_y) // cell_size))
+            for row in range(first_row, last_row + 1):
+                B = self.min_y + (row + 0.5) * cell_size - y1
+                offset = row * columns
+                for column in range(first_column, last_column + 1):
+                    A = self.min_x + (column + 0.5) * cell_size - x1
+                    param = 0 if len_sq == 0 else min(1, max(0, (A * C + B * D) / len_sq))
+                    d = math.hypot(A - param * C, B - param * D)
+                    if d < distance[offset + column]:
+                        distance[offset + column] = d
+        
+        # 内外は各行の中心線と辺の交点（レイキャスティングと同じ規則）から求める
+        crossings = [[] for _ in range(rows)]
+        for x1, y1, x2, y2 in edges:
+            if y1 == y2:
+                continue
+            first = int(math.floor((min(y1, y2) - self.min_y) / cell_size - 0.5)) + 1
+            last = int(math.floor((max(y1, y2) - self.min_y) / cell_size - 0.5))
+            for row in range(max(0, first), min(rows - 1, last) + 1):
+                center_y = self.min_y + (row + 0.5) * cell_size
+                crossings[row].append((center_y - y1) * (x2 - x1) / (y2 - y1) + x1)
+        for row in range(rows):
+            row_crossings = sorted(crossings[row])
+            # 中心より左にある交点の数を数えながら、右側の交点数の偶奇で内外を決める
+            remaining = len(row_crossings)
+            k = 0
+            offset = row * columns
+            for column in range(columns):
+                center_x = self.min_x + (column + 0.5) * cell_size
+                while k < len(row_crossings) and row_crossings[k] < center_x:
+                    k += 1
+                if (remaining - k) % 2 == 0:
+                    distance[offset + column] = -distance[offset + column]
+        self.distance = distance
+
+    def classify(self, x, y, radius):
+        """分類コード、または厳密判定が必要な場合は None を返す"""
+        column = int((x - self.min_x) // self.cell_size)
+        row = int((y - self.min_y) // self.cell_size)
+        if not (0 <= column < self.columns and 0 <= row < self.rows):
+            return None
+        d = self.distance[row * self.columns + column]
+        if d > radius + self.diagonal:
+            return VIA_INSIDE
+        if -d > radius + self.diagonal:
+            return VIA_OUTSIDE
+        return None
+
+
+class NativeOutline:
+    """KiCadが作成した基板外形（SHAPE_POLY_SET）の輪郭
+
+    穴を含むすべての輪郭はKiCad側で作成される。KiCadからは座標だけを取り出し（GUIスレッドで）、
+    分類はPythonの外形線と同じく outline（BoardOutline）の事前判定とインデックスで作業スレッドから行う
+    （分類中はSWIGを呼び出さない）。
+    """
+
+    def __init__(self, poly):
+        self.poly = poly
+        chains = []
+        for outline in range(poly.OutlineCount()):
+            chains.append(poly.Outline(outline))
+            for hole in range(poly.HoleCount(outline) if hasattr(poly, "HoleCount") else 0):
+                chains.append(poly.Hole(outline, hole))
+        
+        self.outline = BoardOutline(
+            ((p.x, p.y) for p in (chain.CPoint(i) for i in range(chain.PointCount())))
+            for chain in chains)
+
+
+class ReferenceRegion:
+    """VIAの分類の基準にする名前付きの領域（基板外形・縁からのクリアランス・キープアウト・コートヤードなど）
+
+    outlineは BoardOutline、またはそのリスト（フットプリントごとのコートヤードなど）。リストの場合は
+    各外形線の和集合を領域とし、いずれかの内側なら「内側」、そうでなくいずれかに重なれば「重複」とする
+    （外形線ごとに判定するため、重なる・接する外形線どうしでも内外が打ち消し合わない。ただし接する
+    外形線の境界をまたぐVIAは、和集合の内側に収まっていても「重複」とする）。
+    clearanceはVIA半径に加える距離で、輪郭からclearance以内を「重複」とする
+    （基板外形にclearanceを付けると、外形線から内側にclearanceだけ狭めた領域として判定する）。
+    """
+
+    def __init__(self, name, outline, clearance=0):
+        self.name = name
+        self.outline = outline
+        self.clearance = clearance
+
+    @property
+    def parts(self):
+        """領域を構成する外形線のリスト"""
+        parts = self.outline if isinstance(self.outline, list) else [self.outline]
+        return [part for part in parts if part]
+
+
+def region_code(mask, bit):
+    """classify_regionsのビットマスクから領域bitの分類コードを取り出す"""
+    if mask >> (2 * bit + 1) & 1:
+        return VIA_OVERLAP
+    return VIA_INSIDE if mask >> (2 * bit) & 1 else VIA_OUTSIDE
+
+
+class OutlineCache:
+    """Edge.Cutsの内容ハッシュをキーにした外形線キャッシュ（LRUで件数を制限）"""
+
+    def __init__(self, max_entries=OUTLINE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def make_key(self, shapes, chord_tolerance=None):
+        """図形の種類・座標・レイヤーと円弧の許容誤差からキーを作成"""
+        digest = hashlib.sha1(repr((OUTLINE_CACHE_VERSION, chord_tolerance, shapes)).encode("utf-8"))
+        return digest.hexdigest()
+
+    def path_for_board(self, board):
+        """基板ファイルの隣に置くキャッシュファイルのパス（未保存の基板はNone）"""
+        file_name = board.GetFileName()
+        if not file_name:
+            return None
+        return os.path.splitext(file_name)[0] + ".via-classifier-cache.json"
+
+    def get(self, key, path=None):
+        """キャッシュ済みの (外形線, デバッグ情報) を返す。無ければNone"""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        if path and os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("key") == key:
+                    outline = BoardOutline(data["contours"])
+                    self._store(key, (outline, data.get("debug_info", "")))
+                    return self.entries[key]
+            except (OSError, ValueError, KeyError, TypeError):
+                pass  # 壊れたキャッシュファイルは無視して作り直す
+        return None
+
+    def put(self, key, outline, debug_info, path=None):
+        """外形線を登録し、pathが指定されていればファイルにも保存"""
+        self._store(key, (outline, debug_info))
+        if path:
+            try:
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump({"key": key, "contours": outline.contours,
+                               "debug_info": debug_info}, f)
+            except OSError:
+                pass  # 保存できなくても処理は続行
+
+    def _store(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class Diagnostics:
+    """処理段階ごとの経過時間と件数を記録する（診断情報の表示・JSON出力用）"""
+
+    # 表示用の段階名
+    PHASE_LABELS = {
+        "read_board": "基板の読込",
+        "native_outline": "KiCadの基板外形の取得",
+        "via_scan": "VIAの走査",
+        "edge_shapes": "Edge.Cutsの図形の収集",
+        "tessellate": "円弧・図形の線分化",
+        "chain": "セグメントの連結",
+        "fillet": "仮想フィレット",
+        "distance_field": "距離場の作成",
+        "classify": "VIAの分類",
+        "delete": "VIAの削除",
+    }
+
+    def __init__(self):
+        self.phases = OrderedDict()
+        self.counters = OrderedDict()
+
+    @contextmanager
+    def phase(self, name):
+        """with文で囲んだ区間の経過時間を name の段階に加算"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            entry = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+            entry["seconds"] += time.perf_counter() - start
+            entry["calls"] += 1
+
+    def count(self, name, value=1):
+        """カウンターに加算"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def edges_tested_per_via(self):
+        """1VIAあたりに幾何判定した外形線の辺の数"""
+        computed = self.counters.get("vias_computed", 0)
+        return self.counters.get("edges_tested", 0) / computed if computed else 0.0
+
+    def prefilter_rates(self):
+        """事前判定の段階ごとの割合（分類を計算したVIAに対する割合）"""
+        total = sum(self.counters.get(tier, 0) for tier in OutlinePrefilter.TIERS)
+        return OrderedDict((tier, self.counters.get(tier, 0) / total if total else 0.0)
+                           for tier in OutlinePrefilter.TIERS)
+
+    def format_text(self):
+        """診断情報ダイアログ用のテキスト"""
+        text = "\n処理時間:\n"
+        for name, entry in self.phases.items():
+            label = self.PHASE_LABELS.get(name, name)
+            text += f"  {label} ({name}): {entry['seconds'] * 1000:.1f}ms ({entry['calls']}回)\n"
+        text += "カウンター:\n"
+        for name, value in self.counters.items():
+            text += f"  {name}: {value}\n"
+        text += f"  1VIAあたりの判定辺数: {self.edges_tested_per_via():.1f}\n"
+        rates = self.prefilter_rates()
+        text += "事前判定:\n"
+        text += f"  外接矩形の外側: {rates['prefilter_bbox']:.1%}\n"
+        text += f"  格子（内側）: {rates['prefilter_inside']:.1%}\n"
+        text += f"  格子（外側）: {rates['prefilter_outside']:.1%}\n"
+        text += f"  距離場: {rates['distance_field']:.1%}\n"
+        text += f"  厳密判定: {rates['prefilter_exact']:.1%}\n"
+        return text
+
+    def to_dict(self, debug_info=None):
+        """JSON出力用の辞書"""
+        data = {
+            "phases": self.phases,
+            "counters": self.counters,
+            "edges_tested_per_via": self.edges_tested_per_via(),
+            "prefilter_rates": self.prefilter_rates(),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "numpy": np.__version__ if np is not None else None,
+                "kicad": pcbnew.GetBuildVersion() if pcbnew is not None and hasattr(pcbnew, "GetBuildVersion") else None,
+            },
+        }
+        if debug_info is not None:
+            data["debug_info"] = debug_info
+        return data
+
+
+class ViaSnapshot:
+    """基板のVIAを1回の走査で取り出した配列ベースのスナップショット
+
+    以降の分類・件数表示・削除はこのスナップショットを参照し、pcbnew（SWIG）を再度呼び出さない。
+    itemsは削除などで基板のVIAオブジェクトに戻るためのリストで、他の属性と同じ添字を使う。
+    """
 
-class ViaClassifierPlugin(pcbnew.ActionPlugin):
+    def __init__(self):
+        self.items = []
+        self.uuids = []
+        self.xs = array("q")
+        self.ys = array("q")
+        self.widths = array("q")
+        self.radii = array("q")
+        self.drills = array("q")
+        self.selected = array("b")
+        self.top_layers = array("i")
+        self.bottom_layers = array("i")
+        self.selected_count = 0
+
+    @classmethod
+    def from_board(cls, board):
+        """board.Tracks() を1回だけ走査してスナップショットを作成"""
+        snapshot = cls()
+        via_type = pcbnew.PCB_VIA_T
+        for track in board.Tracks():
+            if track.Type() != via_type:
+                continue
+            position = track.GetPosition()
+            snapshot.append(track, track.m_Uuid.AsString(), position.x, position.y, track.GetWidth(),
+                            track.GetDrillValue(), track.IsSelected(), track.TopLayer(), track.BottomLayer())
+        return snapshot
+
+    def append(self, item, uuid, x, y, width, drill, selected, top_layer, bottom_layer):
+        """VIAを1つ追加"""
+        self.items.append(item)
+        self.uuids.append(uuid)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.widths.append(width)
+        self.radii.append(width // 2)
+        self.drills.append(drill)
+        self.selected.append(1 if selected else 0)
+        self.top_layers.append(top_layer)
+        self.bottom_layers.append(bottom_layer)
+        if selected:
+            self.selected_count += 1
+
+    def __len__(self):
+        return len(self.items)
+
+    def indices(self, selected_only=False):
+        """対象のVIAの添字のリスト"""
+        if selected_only:
+            return [i for i, selected in enumerate(self.selected) if selected]
+        return list(range(len(self.items)))
+
+    def records(self, indices=None):
+        """(UUID, x, y, 幅) のVIAレコードのリスト（classify_via_records用）"""
+        if indices is None:
+            return list(zip(self.uuids, self.xs, self.ys, self.widths))
+        uuids, xs, ys, widths = self.uuids, self.xs, self.ys, self.widths
+        return [(uuids[i], xs[i], ys[i], widths[i]) for i in indices]
+
+    def without(self, items):
+        """itemsのVIAを除いたスナップショット（削除後の更新用、基板は再走査しない）"""
+        removed = set(id(item) for item in items)
+        snapshot = ViaSnapshot()
+        for i, item in enumerate(self.items):
+            if id(item) in removed:
+                continue
+            snapshot.append(item, self.uuids[i], self.xs[i], self.ys[i], self.widths[i], self.drills[i],
+                            self.selected[i], self.top_layers[i], self.bottom_layers[i])
+        return snapshot
+
+
+class ViaProximity:
+    """近接・重複するVIAの検出結果（analyze_via_proximityで作成）
+
+    pairsは穴と穴の間隔がclearance未満のVIAの組 (先のVIAの添字, 後のVIAの添字, 間隔) のリスト。
+    clustersは組でつながるVIAの添字のリスト、removableは走査順で先のVIAを残す場合に削除するVIAの添字。
+    """
+
+    def __init__(self, clearance):
+        self.clearance = clearance
+        self.pairs = []
+        self.duplicates = 0
+        self.clusters = []
+        self.removable = []
+
+    def summary(self):
+        """デバッグ情報用の1行"""
+        return (f"近接・重複するVIA: {len(self.pairs)}組（同じ位置 {self.duplicates}組, クラスター {len(self.clusters)}個, "
+                f"削除候補 {len(self.removable)}個, 穴の間隔の最小値 {self.clearance / 1000000:.3f}mm）\n")
+
+
+class ViaResultTable:
+    """結果一覧（仮想リスト）用のVIAの分類結果の表
+
+    行はスナップショットの添字の配列で、絞り込みと並べ替えはこの配列だけを作り直す。
+    ネット名はKiCadへの呼び出しになるため、表示した行とネットでの絞り込み・並べ替えの分だけ取得する。
+    外形線までの距離（VIAの外周から最も近い辺まで、重なる場合は負）は表示した行の分だけ計算し、
+    距離で並べ替える時にまとめて計算する。距離での絞り込みは上限以内に辺があるかだけを調べる。
+    """
+
+    COLUMNS = (
+        ("category", "分類", 70),
+        ("net", "ネット", 150),
+        ("diameter", "直径(mm)", 80),
+        ("drill", "ドリル(mm)", 80),
+        ("distance", "外形線まで(mm)", 110),
+        ("x", "X(mm)", 90),
+        ("y", "Y(mm)", 90),
+    )
+    CATEGORY_NAMES = {VIA_INSIDE: "内側", VIA_OUTSIDE: "外側", VIA_OVERLAP: "重複"}
+
+    def __init__(self, snapshot, codes, index):
+        """codesは {スナップショットの添字: 分類コード}、indexは外形線の OutlineIndex"""
+        self.snapshot = snapshot
+        self.codes = codes
+        self.nets = {}
+        self.index = index
+        self.distances = {}
+        self.indices = array("q", sorted(codes))
+        self.rows = array("q", self.indices)
+        self.sort_column = None
+        self.sort_descending = False
+
+    def __len__(self):
+        return len(self.rows)
+
+    def item(self, row):
+        """行のVIAオブジェクト"""
+        return self.snapshot.items[self.rows[row]]
+
+    def net_name(self, index):
+        """VIAのネット名（未取得ならVIAから取得する）"""
+        name = self.nets.get(index)
+        if name is None:
+            name = self.snapshot.items[index].GetNetname()
+            self.nets[index] = name
+        return name
+
+    def edge_gap(self, index):
+        """VIAの外周から外形線までの距離（未計算なら計算する）"""
+        gap = self.distances.get(index)
+        if gap is None:
+            snapshot = self.snapshot
+            gap = self.index.distance(snapshot.xs[index], snapshot.ys[index]) - snapshot.radii[index]
+            self.distances[index] = gap
+        return gap
+
+    def gap_within(self, index, limit):
+        """VIAの外周から外形線までの距離がlimit以下か（未計算なら距離は求めずに判定する）"""
+        gap = self.distances.get(index)
+        if gap is not None:
+            return gap <= limit
+        snapshot = self.snapshot
+        return self.index.overlaps(snapshot.xs[index], snapshot.ys[index], snapshot.radii[index] + limit)
+
+    def missing_distances(self, indices=None):
+        """外形線までの距離が未計算の添字のリスト"""
+        return [i for i in (self.indices if indices is None else indices) if i not in self.distances]
+
+    def compute_distances(self, indices, progress=None, cancel=None):
+        """indicesの距離を計算（キャンセルされた場合はNone）"""
+        for begin in range(0, len(indices), PROGRESS_CHUNK):
+            if cancel is not None and cancel.is_set():
+                return None
+            for i in indices[begin:begin + PROGRESS_CHUNK]:
+                self.edge_gap(i)
+            if progress is not None:
+                progress(min(begin + PROGRESS_CHUNK, len(indices)), len(indices))
+        return True
+
+    def sort_key(self, column):
+        """列ごとの並べ替えのキー（添字 -> 値）"""
+        snapshot = self.snapshot
+        return {
+            "category": self.codes.__getitem__,
+            "net": self.net_name,
+            "diameter": snapshot.widths.__getitem__,
+            "drill": snapshot.drills.__getitem__,
+            "distance": self.edge_gap,
+            "x": snapshot.xs.__getitem__,
+            "y": snapshot.ys.__getitem__,
+        }[column]
+
+    def sort(self, column, descending=False):
+        """行を列の値で並べ替え（同じ値の行はスナップショットの順）"""
+        self.sort_column = column
+        self.sort_descending = descending
+        self.rows = array("q", sorted(self.rows, key=self.sort_key(column), reverse=descending))
+
+    def filter(self, categories, net="", min_diameter=None, max_diameter=None, max_distance=None):
+        """条件に合う行だけを残す（直径・距離はKiCad内部単位、Noneは条件なし）"""
+        codes, widths = self.codes, self.snapshot.widths
+        net = net.lower()
+        rows = []
+        for i in self.indices:
+            if codes[i] not in categories:
+                continue
+            if net and net not in self.net_name(i).lower():
+                continue
+            if min_diameter is not None and widths[i] < min_diameter:
+                continue
+            if max_diameter is not None and widths[i] > max_diameter:
+                continue
+            if max_distance is not None and not self.gap_within(i, max_distance):
+                continue
+            rows.append(i)
+        self.rows = array("q", rows)
+        if self.sort_column is not None:
+            self.sort(self.sort_column, self.sort_descending)
+
+    def remove(self, indices):
+        """削除したVIAを表から取り除く"""
+        removed = set(indices)
+        for i in removed:
+            self.codes.pop(i, None)
+        self.indices = array("q", (i for i in self.indices if i not in removed))
+        self.rows = array("q", (i for i in self.rows if i not in removed))
+
+    def cell(self, row, column):
+        """表示する文字列（仮想リストから表示される行の分だけ呼ばれる）"""
+        index = self.rows[row]
+        key = self.COLUMNS[column][0]
+        snapshot = self.snapshot
+        if key == "category":
+            return self.CATEGORY_NAMES[self.codes[index]]
+        if key == "net":
+            return self.net_name(index)
+        if key == "distance":
+            return f"{self.edge_gap(index) / 1000000:.3f}"
+        value = {"diameter": snapshot.widths, "drill": snapshot.drills, "x": snapshot.xs, "y": snapshot.ys}[key][index]
+        return f"{value / 1000000:.3f}"
+
+
+if wx is not None:
+    class ViaListCtrl(wx.ListCtrl):
+        """ViaResultTableを表示する仮想リスト（表示される行の文字列だけを作る）"""
+
+        def __init__(self, parent, table):
+            super().__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_HRULES | wx.LC_VRULES)
+            self.table = table
+            for column, (_key, label, width) in enumerate(table.COLUMNS):
+                self.InsertColumn(column, label, width=width)
+            self.refresh_rows()
+
+        def OnGetItemText(self, item, column):
+            return self.table.cell(item, column)
+
+        def refresh_rows(self):
+            """行数を表に合わせて再描画"""
+            self.SetItemCount(len(self.table))
+            self.Refresh()
+
+        def selected_rows(self):
+            """選択されている行番号のリスト"""
+            rows = []
+            row = self.GetFirstSelected()
+            while row != -1:
+                rows.append(row)
+                row = self.GetNextSelected(row)
+            return rows
+else:
+    ViaListCtrl = None
+
+
+class LiveClassifier:
+    """ライブモード: 基板の変更を受けて、追加・移動・サイズ変更されたVIAだけを再分類し件数を保つ
+
+    BOARD_LISTENERが使える場合は変更通知で変更を検出する。リスナーを登録できても通知が届かない
+    ビルドがあるため、最初の通知が届くまではタイマーで基板も走査する。走査は基板全体を読むため、
+    前回の走査時間に応じた間隔を空け、基板のタイムスタンプが使えれば変わった時だけ行い、
+    LIVE_POLL_WINDOW_MS を過ぎたらやめる。タイマーは基板が閉じられた・
+    別の基板が開かれたことの検出にも使う。外形線はEdge.Cutsの図形が変わった場合だけ作り直し、
+    その時だけ全VIAを再分類する。変更通知の中ではレコードを記録するだけにして、再分類は
+    wx.CallAfterでまとめて行う。GUIスレッドだけで動作する。
+    """
+
+    def __init__(self, plugin, board, records, outline, shapes):
+        self.plugin = plugin
+        self.board = board
+        self.outline = outline
+        self.shapes_key = plugin.outline_cache.make_key(shapes)
+        self.records = {}  # UUID -> (UUID, x, y, 幅)
+        self.codes = {}  # UUID -> 分類コード
+        self.counts = [0, 0, 0]  # 分類コードごとのVIA数
+        self.pending = {}  # UUID -> 変更後のレコード（削除された場合はNone）
+        self.outline_dirty = False
+        self.flush_scheduled = False
+        self.listener = None
+        self.listener_seen = False  # 変更通知が1回でも届いたか
+        self.polling = True  # 変更通知が届くまでの基板の走査を続けているか
+        self.poll_deadline = 0.0  # 走査をやめる時刻（time.perf_counter）
+        self.poll_interval = LIVE_POLL_INTERVAL_MS / 1000  # 走査の間隔（秒）
+        self.next_poll = 0.0
+        self.signature = None  # 前回走査した時の board_signature
+        self.timer = None
+        self.frame = None
+        self.labels = {}
+        self.last_update = ""
+        self.apply(records)
+
+    @staticmethod
+    def via_record(item):
+        """VIAの (UUID, x, y, 幅) レコード"""
+        position = item.GetPosition()
+        return (item.m_Uuid.AsString(), position.x, position.y, item.GetWidth())
+
+    def apply(self, changed, removed=()):
+        """変更・追加されたVIAのレコードと削除されたVIAのUUIDを反映し、再分類したVIAの数を返す"""
+        for uuid in removed:
+            self._forget(uuid)
+        changed = [record for record in changed if self.records.get(record[0]) != record]
+        for record in changed:
+            self._forget(record[0])
+            self.records[record[0]] = record
+        if not changed or not self.outline:
+            return 0
+        codes = self.plugin.classify_via_records(changed, self.outline)
+        for record, code in zip(changed, codes):
+            self.codes[record[0]] = code
+            self.counts[code] += 1
+        return len(changed)
+
+    def _forget(self, uuid):
+        """VIAの記録と件数を取り除く（移動前の位置の分類結果も破棄する）"""
+        record = self.records.pop(uuid, None)
+        if record is not None:
+            self.plugin.via_results.pop(record, None)
+        code = self.codes.pop(uuid, None)
+        if code is not None:
+            self.counts[code] -= 1
+
+    def rebuild_outline(self):
+        """Edge.Cutsの図形から外形線を作り直し、すべてのVIAを再分類"""
+        plugin = self.plugin
+        shapes, _debug_info = plugin.collect_edge_shapes(self.board)
+        self.shapes_key = plugin.outline_cache.make_key(shapes)
+        native = plugin.get_native_outline(self.board)[0] if plugin.use_native_engine else None
+        if native is not None:
+            self.outline = native.outline
+        else:
+            chord_tolerance = plugin.chord_tolerance_for(record[3] // 2 for record in self.records.values())
+            self.outline = plugin.get_outline_from_shapes(shapes, None, chord_tolerance)[0]
+        records = list(self.records.values())
+        self.records, self.codes, self.counts = {}, {}, [0, 0, 0]
+        plugin.diagnostics.count("live_outline_rebuilds")
+        return self.apply(records)
+
+    def on_items_changed(self, items):
+        """追加・変更された基板のアイテムを記録（変更通知から呼ばれる）"""
+        for item in items:
+            item = item.Cast() if hasattr(item, "Cast") else item
+            if item.Type() == pcbnew.PCB_VIA_T:
+                record = self.via_record(item)
+                self.pending[record[0]] = record
+            elif self.is_edge_item(item):
+                self.outline_dirty = True
+        self.schedule_flush()
+
+    def on_items_removed(self, items):
+        """削除された基板のアイテムを記録（変更通知から呼ばれる）"""
+        for item in items:
+            item = item.Cast() if hasattr(item, "Cast") else item
+            if item.Type() == pcbnew.PCB_VIA_T:
+                self.pending[item.m_Uuid.AsString()] = None
+            elif self.is_edge_item(item):
+                self.outline_dirty = True
+        self.schedule_flush()
+
+    def is_same_board(self, board):
+        """boardがライブモードの基板か（SWIGのプロキシは取得のたびに作られるため、C++のポインタで比べる）"""
+        if board is None:
+            return False
+        if board is self.board:
+            return True
+        this = getattr(self.board, "this", None)
+        return this is not None and this == getattr(board, "this", None)
+
+    def board_is_open(self):
+        """ライブモードの基板がPCBエディタで開かれたままか"""
+        return self.is_same_board(pcbnew.GetBoard())
+
+    def is_edge_item(self, item):
+        return hasattr(item, "GetLayer") and item.GetLayer() == pcbnew.Edge_Cuts
+
+    def schedule_flush(self):
+        if (self.pending or self.outline_dirty) and not self.flush_scheduled:
+            self.flush_scheduled = True
+            wx.CallAfter(self.flush)
+
+    def board_signature(self):
+        """基板全体を走査せずに得られる変更の目印（KiCadが変更のたびに進める基板のタイムスタンプ）
+
+        使えないビルドでは None を返し、走査の間隔が過ぎるたびに基板を走査する。
+        """
+        if hasattr(self.board, "GetTimeStamp"):
+            return self.board.GetTimeStamp()
+        return None
+
+    def on_timer(self):
+        """基板が閉じられていれば終了し、変更通知が届いていなければ必要な時だけ基板を走査する"""
+        if not self.board_is_open():
+            self.frame.Close()  # 閉じる時に変更通知・タイマーも解除される
+            return
+        if self.listener_seen or not self.polling:
+            return
+        now = time.perf_counter()
+        if now >= self.poll_deadline:
+            self.polling = False  # 通知が届かないまま走査の期限を過ぎた
+            self.update_frame()
+            return
+        if now < self.next_poll:
+            return
+        signature = self.board_signature()
+        if signature is not None and signature == self.signature:
+            return  # 前回の走査から基板は変更されていない
+        self.signature = signature
+        self.poll()
+        cost = time.perf_counter() - now
+        self.poll_interval = max(LIVE_POLL_INTERVAL_MS / 1000, cost * LIVE_POLL_COST_FACTOR)
+        self.next_poll = time.perf_counter() + self.poll_interval
+        self.update_frame()
+
+    def poll(self):
+        """変更通知が使えない場合: 基板を走査して前回との差分を記録し、反映する"""
+        current = {record[0]: record for record in ViaSnapshot.from_board(self.board).records()}
+        self.pending.update((uuid, None) for uuid in self.records if uuid not in current)
+        self.pending.update((uuid, record) for uuid, record in current.items() if self.records.get(uuid) != record)
+        shapes, _debug_info = self.plugin.collect_edge_shapes(self.board)
+        if self.plugin.outline_cache.make_key(shapes) != self.shapes_key:
+            self.outline_dirty = True
+        if self.pending or self.outline_dirty:
+            self.flush()
+
+    def flush(self):
+        """記録した変更をまとめて反映し、件数の表示を更新"""
+        self.flush_scheduled = False
+        if self.timer is None or not self.board_is_open():
+            return  # 停止済み、または基板が閉じられた（次のタイマーで終了する）
+        pending, self.pending = self.pending, {}
+        removed = [uuid for uuid, record in pending.items() if record is None]
+        changed = [record for record in pending.values() if record is not None]
+        start = time.perf_counter()
+        with self.plugin.diagnostics.phase("live_update"):
+            if self.outline_dirty:
+                self.outline_dirty = False
+                for uuid in removed:
+                    self.records.pop(uuid, None)
+                self.records.update((record[0], record) for record in changed)
+                count = self.rebuild_outline()
+                self.last_update = f"外形線を更新: {count}個のVIAを再分類"
+            else:
+                count = self.apply(changed, removed)
+                self.last_update = f"{count}個のVIAを再分類"
+        self.last_update += f" ({(time.perf_counter() - start) * 1000:.1f}ms)"
+        self.plugin.diagnostics.count("live_updates")
+        self.plugin.diagnostics.count("live_vias_reclassified", count)
+        self.update_frame()
+
+    def start(self, parent=None):
+        """件数を表示するウィンドウを開き、変更通知（使えない場合はタイマー）で更新を始める"""
+        self.frame = self.create_frame(parent)
+        if LIVE_USE_LISTENER and LiveBoardListener is not None:
+            try:
+                listener = LiveBoardListener(self)
+                self.board.AddListener(listener)
+                self.listener = listener
+            except (AttributeError, TypeError, NotImplementedError):
+                self.listener = None
+        # 最初の走査の時間は、プラグインの実行時にVIAとEdge.Cutsの図形を読んだ時間から見積もる
+        estimate = sum(entry["seconds"] / max(entry["calls"], 1)
+                       for name, entry in self.plugin.diagnostics.phases.items() if name in ("via_scan", "edge_shapes"))
+        self.poll_interval = max(LIVE_POLL_INTERVAL_MS / 1000, estimate * LIVE_POLL_COST_FACTOR)
+        self.signature = self.board_signature()
+        self.poll_deadline = time.perf_counter() + LIVE_POLL_WINDOW_MS / 1000
+        self.next_poll = time.perf_counter() + self.poll_interval
+        self.timer = wx.Timer(self.frame)
+        self.frame.Bind(wx.EVT_TIMER, lambda evt: self.on_timer(), self.timer)
+        self.timer.Start(LIVE_POLL_INTERVAL_MS)
+        self.update_frame()
+        self.frame.Show()
+
+    def stop(self):
+        """変更通知・タイマーを解除"""
+        if self.listener is not None:
+            # 閉じられた基板は解放済みのため、リスナーの解除を呼び出さない
+            if self.board_is_open():
+                try:
+                    self.board.RemoveListener(self.listener)
+                except (AttributeError, TypeError):
+                    pass
+            self.listener = None
+        if self.timer is not None:
+            self.timer.Stop()
+            self.timer = None
+        if self.plugin.live is self:
+            self.plugin.live = None
+
+    def create_frame(self, parent):
+        """件数を表示するモードレスのウィンドウ"""
+        frame = wx.Frame(parent, title="VIA分類（ライブ）", size=(320, 220),
+                         style=wx.DEFAULT_FRAME_STYLE | wx.FRAME_FLOAT_ON_PARENT)
+        panel = wx.Panel(frame)
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        for key in ("inside", "outside", "overlap", "total", "mode", "last"):
+            self.labels[key] = wx.StaticText(panel, label="")
+            vbox.Add(self.labels[key], flag=wx.LEFT | wx.TOP, border=10)
+        btn_stop = wx.Button(panel, wx.ID_CLOSE, "停止")
+        vbox.Add(btn_stop, flag=wx.ALIGN_CENTER | wx.ALL, border=10)
+        panel.SetSizer(vbox)
+        
+        def on_close(evt):
+            self.stop()
+            frame.Destroy()
+        
+        btn_stop.Bind(wx.EVT_BUTTON, lambda evt: frame.Close())
+        frame.Bind(wx.EVT_CLOSE, on_close)
+        return frame
+
+    def update_frame(self):
+        """件数の表示を更新"""
+        if self.frame is None:
+            return
+        inside, outside, overlap = self.counts
+        if not self.outline:
+            self.labels["inside"].SetLabel("基板の外形線が見つかりません")
+            self.labels["outside"].SetLabel("")
+            self.labels["overlap"].SetLabel("")
+        else:
+            self.labels["inside"].SetLabel(f"内側のVIA: {inside}個")
+            self.labels["outside"].SetLabel(f"外側のVIA: {outside}個")
+            self.labels["overlap"].SetLabel(f"外形線と重複するVIA: {overlap}個")
+        self.labels["total"].SetLabel(f"合計: {len(self.records)}個のVIA")
+        interval = f"{self.poll_interval:.1f}秒ごとに基板を確認"
+        if self.listener_seen:
+            mode = "基板の変更通知"
+        elif not self.polling:
+            mode = "使用できません（基板の変更通知が届きません。件数を更新するにはプラグインを再実行してください）"
+        elif self.listener is None:
+            mode = f"{interval}（{LIVE_POLL_WINDOW_MS // 1000}秒間）"
+        else:
+            mode = f"基板の変更通知（通知が届くまでは{interval}、{LIVE_POLL_WINDOW_MS // 1000}秒間）"
+        self.labels["mode"].SetLabel("更新方法: " + mode)
+        self.labels["last"].SetLabel(f"最終更新: {self.last_update}" if self.last_update else "")
+        self.frame.Layout()
+
+
+if pcbnew is not None and hasattr(pcbnew, "BOARD_LISTENER"):
+    class LiveBoardListener(pcbnew.BOARD_LISTENER):
+        """BOARD_LISTENERの通知をLiveClassifierに渡す"""
+
+        def __init__(self, live):
+            super().__init__()
+            self.live = live
+
+        def changed(self, items):
+            self.live.listener_seen = True
+            self.live.on_items_changed(items)
+
+        def removed(self, items):
+            self.live.listener_seen = True
+            self.live.on_items_removed(items)
+
+        def OnBoardItemAdded(self, board, item):
+            self.changed([item])
+
+        def OnBoardItemsAdded(self, board, items):
+            self.changed(items)
+
+        def OnBoardItemChanged(self, board, item):
+            self.changed([item])
+
+        def OnBoardItemsChanged(self, board, items):
+            self.changed(items)
+
+        def OnBoardItemRemoved(self, board, item):
+            self.removed([item])
+
+        def OnBoardItemsRemoved(self, board, items):
+            self.removed(items)
+
+        def OnBoardCompositeUpdate(self, board, added, removed, changed):
+            self.removed(removed)
+            self.changed(list(added) + list(changed))
+else:
+    LiveBoardListener = None
+
+
+class ViaClassifierPlugin(pcbnew.ActionPlugin if pcbnew is not None else object):
     def __init__(self):
         super().__init__()
         self.name = "Via分類ツール"
@@ -21,6 +1396,21 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
         self.description = "基板外形線を基準にVIAを内側/外側/重複に分類します"
         self.show_toolbar_button = True
         self.icon_file_name = os.path.join(os.path.dirname(__file__), 'via_classifier.png')
+        self.outline_cache = OutlineCache()
+        self._outline_index = (None, None)
+        self._outline_prefilter = (None, None)
+        self._region_cache = {}  # classify_regionsの外形線ごとの (外形線, 事前判定, インデックス)
+        self._distance_field = (None, None)
+        self.use_distance_field = DISTANCE_FIELD_ENABLED
+        self.use_native_engine = NATIVE_ENGINE_ENABLED
+        self.via_results = {}
+        self._via_results_outline = None
+        self.live = None  # 実行中のライブモード（LiveClassifier）
+        self.diagnostics = Diagnostics()
+        # 並列分類のワーカープロセス数。プロセスはヘッドレス実行時（parallel_processes=True）だけ使い、
+        # KiCad内では並列化しない
+        self.parallel_workers = os.cpu_count() or 1
+        self.parallel_processes = False
         
     def defaults(self):
         """プラグインのデフォルト設定"""
@@ -33,69 +1423,129 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
         """メイン実行関数"""
         try:  # 全体をtry-exceptで囲む
             board = pcbnew.GetBoard()
+            self.diagnostics = Diagnostics()
             
-            # 選択されたVIAの数をカウント
-            selected_vias_count = sum(1 for track in board.Tracks() if track.Type() == pcbnew.PCB_VIA_T and track.IsSelected())
-            
-            # 進捗ダイアログを表示
-            progress_dialog = wx.ProgressDialog("処理中", "基板の外形線を解析中...", 
-                                              maximum=100, parent=None, 
-                                              style=wx.PD_APP_MODAL | wx.PD_AUTO_HIDE)
-            progress_dialog.Update(10)
+            # 基板へのアクセスはGUIスレッドで行う（VIAの走査とEdge.Cutsの図形の収集）
+            with self.diagnostics.phase("via_scan"):
+                snapshot = ViaSnapshot.from_board(board)
+            selected_vias_count = snapshot.selected_count
+            with self.diagnostics.phase("edge_shapes"):
+                shapes, debug_shape_info = self.collect_edge_shapes(board)
+            cache_path = self.outline_cache.path_for_board(board) if OUTLINE_CACHE_PERSIST else None
+            chord_tolerance = self.chord_tolerance_for(snapshot.radii)
+            native, debug_native_info = self.get_native_outline(board) if self.use_native_engine else (None, "")
+            hole_clearance = self.hole_clearance_for(board)
             
             # デバッグ情報収集開始
-            debug_info = "デバッグ情報:\n"
-            
-            # 基板の外形線を取得
-            try:
-                # デバッグを有効にした外形線取得
-                edge_points, debug_edge_info = self.get_board_outline_debug(board)
-                debug_info += debug_edge_info
-                
-                if not edge_points:
-                    # デバッグ情報を含むエラーメッセージ
-                    progress_dialog.Destroy()
-                    self.show_debug_dialog("外形線が見つからないエラー", debug_info + 
-                                        "基板の外形線が見つかりませんでした。Edge.Cutsレイヤーに正しく外形線が作成されているか確認してください。")
-                    return
-            except Exception as e:
-                progress_dialog.Destroy()
-                error_trace = traceback.format_exc()
-                self.show_debug_dialog("外形線処理エラー", debug_info + 
-                                    f"基板外形線の処理中にエラーが発生しました:\n{str(e)}\n\n{error_trace}")
-                return
-                
-            progress_dialog.Update(30, "VIAを分類中...")
+            debug_info = "デバッグ情報:\n" + debug_shape_info + debug_native_info
             
             # 初期分類（デフォルトは選択されたVIAのみ、選択がない場合は基板全体）
             use_selection_only = selected_vias_count > 0
+            stage = ["outline"]
+            
+            # 外形線の作成と分類は作業スレッドで実行（pcbnewは呼び出さない）
+            def work(progress, cancel):
+                if native is not None:
+                    edge_points, debug_edge_info = native.outline, ""
+                else:
+                    edge_points, debug_edge_info = self.get_outline_from_shapes(shapes, cache_path, chord_tolerance)
+                if not edge_points or cancel.is_set():
+                    return edge_points, debug_edge_info, None, None
+                stage[0] = "classify"
+                progress(10, "VIAを分類中...")
+                result = self.classify_vias(snapshot, edge_points, use_selection_only,
+                                            self.via_progress(progress, 10, 90), cancel)
+                if result is None:
+                    return edge_points, debug_edge_info, None, None
+                progress(90, "近接・重複するVIAを検出中...")
+                proximity = self.analyze_via_proximity(snapshot, snapshot.indices(use_selection_only),
+                                                       hole_clearance, None, cancel)
+                return edge_points, debug_edge_info, result, proximity
+            
             try:
-                inside_vias, outside_vias, overlap_vias = self.classify_vias(board, edge_points, use_selection_only)
-                debug_info += f"VIAの分類結果: 内側={len(inside_vias)}個, 外側={len(outside_vias)}個, 重複={len(overlap_vias)}個\n"
+                outcome = self.run_in_background("基板の外形線を解析中...", work)
             except Exception as e:
-                progress_dialog.Destroy()
                 error_trace = traceback.format_exc()
-                self.show_debug_dialog("VIA分類エラー", debug_info + 
-                                    f"VIAの分類中にエラーが発生しました:\n{str(e)}\n\n{error_trace}")
+                if stage[0] == "outline":
+                    self.show_debug_dialog("外形線処理エラー", debug_info + 
+                                        f"基板外形線の処理中にエラーが発生しました:\n{str(e)}\n\n{error_trace}")
+                else:
+                    self.show_debug_dialog("VIA分類エラー", debug_info + 
+                                        f"VIAの分類中にエラーが発生しました:\n{str(e)}\n\n{error_trace}")
                 return
+            if outcome is None:
+                return  # キャンセルされた場合は途中結果を使わずに終了
             
-            progress_dialog.Update(80, "結果を準備中...")
-            progress_dialog.Destroy()
+            edge_points, debug_edge_info, result, proximity = outcome
+            debug_info += debug_edge_info
+            if not edge_points:
+                # デバッグ情報を含むエラーメッセージ
+                self.show_debug_dialog("外形線が見つからないエラー", debug_info + 
+                                    "基板の外形線が見つかりませんでした。Edge.Cutsレイヤーに正しく外形線が作成されているか確認してください。")
+                return
+            
+            inside_vias, outside_vias, overlap_vias = result
+            debug_info += f"VIAの分類結果: 内側={len(inside_vias)}個, 外側={len(outside_vias)}個, 重複={len(overlap_vias)}個\n"
+            debug_info += proximity.summary()
             
             # 統合ダイアログを表示
-            self.show_unified_dialog(board, inside_vias, outside_vias, overlap_vias, selected_vias_count, edge_points, debug_info)
+            self.show_unified_dialog(board, snapshot, inside_vias, outside_vias, overlap_vias, edge_points, debug_info,
+                                     proximity)
             
         except Exception as e:
             # 全体的な例外をキャッチ
             error_trace = traceback.format_exc()
-            try:
-                progress_dialog.Destroy()
-            except:
-                pass
             self.show_debug_dialog("予期せぬエラー", f"プラグインの実行中に予期せぬエラーが発生しました:\n{str(e)}\n\n{error_trace}")
     
-    def show_debug_dialog(self, title, message):
-        """デバッグ情報を表示するダイアログ"""
+    def run_in_background(self, message, work):
+        """workを作業スレッドで実行し、キャンセル可能な進捗ダイアログを表示しながら完了を待つ
+
+        workは (progress, cancel) を受け取る。progress(0〜100の値, メッセージ) で進捗を通知し、
+        cancel（threading.Event）がセットされたら処理を打ち切る。
+        キャンセルされた場合は None を返し、workで発生した例外はこのスレッドで送出し直す。
+        """
+        state = {"value": 0, "message": message, "result": None, "error": None}
+        cancel = threading.Event()
+        
+        def progress(value, message=None):
+            state["value"] = int(value)
+            if message is not None:
+                state["message"] = message
+        
+        def target():
+            try:
+                state["result"] = work(progress, cancel)
+            except Exception as e:
+                state["error"] = e
+        
+        worker = threading.Thread(target=target, name="via-classifier", daemon=True)
+        progress_dialog = wx.ProgressDialog("処理中", message, maximum=100, parent=None,
+                                            style=wx.PD_APP_MODAL | wx.PD_CAN_ABORT | wx.PD_ELAPSED_TIME)
+        worker.start()
+        try:
+            while worker.is_alive():
+                worker.join(0.05)
+                message = "キャンセル中..." if cancel.is_set() else state["message"]
+                keep_going, _skip = progress_dialog.Update(min(state["value"], 99), message)
+                if not keep_going:
+                    cancel.set()
+        finally:
+            progress_dialog.Destroy()
+        
+        if state["error"] is not None:
+            raise state["error"]
+        if cancel.is_set():
+            return None
+        return state["result"]
+
+    def via_progress(self, progress, begin, end):
+        """処理済みVIA数を begin〜end の進捗値に換算して progress に渡すコールバックを作成"""
+        def report(done, total):
+            progress(begin + (end - begin) * done // max(1, total), f"VIAを分類中... ({done}/{total})")
+        return report
+    
+    def show_debug_dialog(self, title, message, export_data=None):
+        """デバッグ情報を表示するダイアログ（export_dataを指定するとJSONで保存できる）"""
         dlg = wx.Dialog(None, title=title, size=(600, 400))
         vbox = wx.BoxSizer(wx.VERTICAL)
         
@@ -103,9 +1553,15 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
         text_ctrl = wx.TextCtrl(dlg, value=message, style=wx.TE_MULTILINE | wx.TE_READONLY | wx.HSCROLL)
         vbox.Add(text_ctrl, proportion=1, flag=wx.EXPAND | wx.ALL, border=10)
         
-        # 閉じるボタン
+        # ボタン
+        btn_box = wx.BoxSizer(wx.HORIZONTAL)
+        if export_data is not None:
+            btn_export = wx.Button(dlg, label="JSONで保存")
+            btn_box.Add(btn_export, flag=wx.RIGHT, border=5)
+            btn_export.Bind(wx.EVT_BUTTON, lambda evt: self.export_json(dlg, export_data))
         btn_close = wx.Button(dlg, wx.ID_CLOSE, "閉じる")
-        vbox.Add(btn_close, flag=wx.ALIGN_CENTER | wx.ALL, border=10)
+        btn_box.Add(btn_close, flag=wx.RIGHT, border=5)
+        vbox.Add(btn_box, flag=wx.ALIGN_CENTER | wx.ALL, border=10)
         
         btn_close.Bind(wx.EVT_BUTTON, lambda evt: dlg.EndModal(wx.ID_CLOSE))
         
@@ -113,207 +1569,306 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
         dlg.ShowModal()
         dlg.Destroy()
         
-    def get_board_outline_debug(self, board):
-        """基板の外形線データを点のリストとして取得し、デバッグ情報も返す"""
-        edge_cut_layer = pcbnew.Edge_Cuts
-        segments = []
+    def export_json(self, parent, data):
+        """辞書をJSONファイルとして保存（保存先はファイルダイアログで選択）"""
+        with wx.FileDialog(parent, "診断情報を保存", wildcard="JSON (*.json)|*.json",
+                           defaultFile="via-classifier-diagnostics.json",
+                           style=wx.FD_SAVE | wx.FD_OVERWRITE_PROMPT) as file_dialog:
+            if file_dialog.ShowModal() != wx.ID_OK:
+                return
+            path = file_dialog.GetPath()
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+        except OSError as e:
+            wx.MessageBox(f"保存できませんでした:\n{str(e)}", "エラー", wx.ICON_ERROR)
+
+    def get_board_outline_debug(self, board, chord_tolerance=ARC_CHORD_ERROR_DEFAULT):
+        """基板の外形線データをBoardOutlineとして取得し、デバッグ情報も返す"""
+        with self.diagnostics.phase("edge_shapes"):
+            shapes, debug_info = self.collect_edge_shapes(board)
+        
+        cache_path = self.outline_cache.path_for_board(board) if OUTLINE_CACHE_PERSIST else None
+        edge_points, outline_debug_info = self.get_outline_from_shapes(shapes, cache_path, chord_tolerance)
+        return edge_points, debug_info + outline_debug_info
+
+    def get_native_outline(self, board):
+        """KiCadの基板外形（GetBoardPolygonOutlines）を取得（使えない場合は None とデバッグ情報）"""
+        if not hasattr(pcbnew, "SHAPE_POLY_SET") or not hasattr(board, "GetBoardPolygonOutlines"):
+            return None, "KiCadの基板外形: このバージョンでは使用できません\n"
+        try:
+            with self.diagnostics.phase("native_outline"):
+                poly = pcbnew.SHAPE_POLY_SET()
+                if not board.GetBoardPolygonOutlines(poly) or poly.OutlineCount() == 0:
+                    return None, "KiCadの基板外形: 作成できませんでした（Pythonの外形線処理を使用）\n"
+                native = NativeOutline(poly)
+        except Exception as e:
+            return None, f"KiCadの基板外形: エラー（{e}）、Pythonの外形線処理を使用\n"
+        if len(native.outline) < 3:
+            return None, "KiCadの基板外形: 点が不足しています（Pythonの外形線処理を使用）\n"
+        self.diagnostics.count("outline_points", len(native.outline))
+        return native, f"KiCadの基板外形を使用: 点{len(native.outline)}個\n" + native.outline.summary()
+
+    def get_outline_from_shapes(self, shapes, cache_path=None, chord_tolerance=ARC_CHORD_ERROR_DEFAULT):
+        """図形から外形線を作成（Edge.Cutsの内容が前回と同じならキャッシュ済みの外形線を使う）"""
+        cache_key = self.outline_cache.make_key(shapes, chord_tolerance)
+        cached = self.outline_cache.get(cache_key, cache_path)
+        if cached is not None:
+            self.diagnostics.count("outline_cache_hits")
+            outline, debug_info = cached
+            return outline, debug_info + "外形線キャッシュ: ヒット\n"
+        
+        outline, debug_info = self.build_outline_from_shapes(shapes, chord_tolerance)
+        if outline:
+            self.outline_cache.put(cache_key, outline, debug_info, cache_path)
+        return outline, debug_info
+
+    def collect_edge_shapes(self, board, layer=None, drawings=None):
+        """Edge.Cutsレイヤー（layerを指定した場合はそのレイヤー）の図形を座標のタプルとして収集
+
+        drawingsを指定した場合は基板の図形の代わりにそのアイテム（フットプリントの図形など）から集める。
+        """
+        edge_cut_layer = pcbnew.Edge_Cuts if layer is None else layer
+        shapes = []
         debug_info = ""
         
         # Edge.Cutsレイヤーの要素をカウント
-        edge_count = sum(1 for drawing in board.GetDrawings() if drawing.GetLayer() == edge_cut_layer)
-        debug_info += f"Edge.Cutsレイヤーの要素数: {edge_count}個\n"
+        drawings = board.GetDrawings() if drawings is None else drawings
+        edge_drawings = [drawing for drawing in drawings
+                         if drawing.GetLayer() == edge_cut_layer and hasattr(drawing, "GetShape")]
+        debug_info += f"{'Edge.Cutsレイヤー' if layer is None else '対象レイヤー'}の要素数: {len(edge_drawings)}個\n"
         
-        # すべての図形要素を収集
-        for drawing in board.GetDrawings():
-            if drawing.GetLayer() == edge_cut_layer:
-                shape_type = drawing.GetShape()
-                
-                # 線分
-                if shape_type == pcbnew.S_SEGMENT:
-                    start = drawing.GetStart()
-                    end = drawing.GetEnd()
-                    segments.append((start, end))
-                
-                # 弧
-                elif shape_type == pcbnew.S_ARC:
-                    start = drawing.GetStart()
-                    end = drawing.GetEnd()
-                    center = drawing.GetCenter()
-                    
-                    radius = math.sqrt((start.x - center.x)**2 + (start.y - center.y)**2)
-                    start_angle = math.atan2(start.y - center.y, start.x - center.x)
-                    end_angle = math.atan2(end.y - center.y, end.x - center.x)
-                    if start_angle < 0:
-                        start_angle += 2 * math.pi
-                    if end_angle < 0:
-                        end_angle += 2 * math.pi
-                    
-                    # KiCadの弧は常に反時計回り
-                    if end_angle <= start_angle:
-                        end_angle += 2 * math.pi
-                    
-                    angle_step = math.radians(5)  # より小さなステップでより正確に
-                    segment_count = abs(int((end_angle - start_angle) / angle_step)) + 1
-                    current_angle = start_angle
-                    last_point = start
-                    
-                    for i in range(segment_count):
-                        next_angle = current_angle + angle_step
-                        if next_angle > end_angle:
-                            next_angle = end_angle
-                        x = center.x + int(radius * math.cos(next_angle))
-                        y = center.y + int(radius * math.sin(next_angle))
-                        next_point = pcbnew.VECTOR2I(x, y)
-                        segments.append((last_point, next_point))
-                        last_point = next_point
-                        current_angle = next_angle
-                        if next_angle >= end_angle:
-                            break
-                
-                # 円
-                elif shape_type == pcbnew.S_CIRCLE:
-                    center = drawing.GetCenter()
-                    radius = drawing.GetRadius()
-                    
-                    # 円を分割して線分として扱う（24分割）
-                    angle_step = 2 * math.pi / 24
-                    for i in range(24):
-                        angle1 = i * angle_step
-                        angle2 = (i + 1) * angle_step
-                        x1 = center.x + int(radius * math.cos(angle1))
-                        y1 = center.y + int(radius * math.sin(angle1))
-                        x2 = center.x + int(radius * math.cos(angle2))
-                        y2 = center.y + int(radius * math.sin(angle2))
-                        start_point = pcbnew.VECTOR2I(x1, y1)
-                        end_point = pcbnew.VECTOR2I(x2, y2)
-                        segments.append((start_point, end_point))
-                
-                # 矩形（重要な追加）
-                elif shape_type == pcbnew.S_RECT:
-                    # 矩形の4つの角の座標を取得
-                    rect_start = drawing.GetStart()
-                    rect_end = drawing.GetEnd()
-                    
-                    # 4つの頂点を計算
-                    x1, y1 = rect_start.x, rect_start.y
-                    x2, y2 = rect_end.x, rect_end.y
-                    
-                    # 矩形の4つの辺を追加
-                    segments.append((pcbnew.VECTOR2I(x1, y1), pcbnew.VECTOR2I(x2, y1)))  # 上辺
-                    segments.append((pcbnew.VECTOR2I(x2, y1), pcbnew.VECTOR2I(x2, y2)))  # 右辺
-                    segments.append((pcbnew.VECTOR2I(x2, y2), pcbnew.VECTOR2I(x1, y2)))  # 下辺
-                    segments.append((pcbnew.VECTOR2I(x1, y2), pcbnew.VECTOR2I(x1, y1)))  # 左辺
-                
-                # ポリゴン
-                elif shape_type == pcbnew.S_POLYGON:
-                    try:
-                        # ポリゴンの頂点を取得
-                        outline = drawing.GetPolyShape().Outline(0)
-                        point_count = outline.PointCount()
-                        
-                        # ポリゴンの各辺を追加
-                        for i in range(point_count):
-                            start_point = outline.CPoint(i)
-                            end_point = outline.CPoint((i + 1) % point_count)
-                            segments.append((start_point, end_point))
-                    except Exception as e:
-                        debug_info += f"ポリゴン処理エラー: {str(e)}\n"
-                
-                # その他の形状
-                else:
-                    debug_info += f"未対応の形状タイプ: {shape_type}\n"
+        for drawing in edge_drawings:
+            shape_type = drawing.GetShape()
+            
+            # 線分
+            if shape_type == pcbnew.S_SEGMENT:
+                start, end = drawing.GetStart(), drawing.GetEnd()
+                shapes.append(("segment", edge_cut_layer, start.x, start.y, end.x, end.y))
+            
+            # 弧
+            elif shape_type == pcbnew.S_ARC:
+                start, end, center = drawing.GetStart(), drawing.GetEnd(), drawing.GetCenter()
+                shapes.append(("arc", edge_cut_layer, start.x, start.y, end.x, end.y, center.x, center.y))
+            
+            # 円
+            elif shape_type == pcbnew.S_CIRCLE:
+                center = drawing.GetCenter()
+                shapes.append(("circle", edge_cut_layer, center.x, center.y, drawing.GetRadius()))
+            
+            # 矩形（重要な追加）
+            elif shape_type == pcbnew.S_RECT:
+                rect_start, rect_end = drawing.GetStart(), drawing.GetEnd()
+                shapes.append(("rect", edge_cut_layer, rect_start.x, rect_start.y, rect_end.x, rect_end.y))
+            
+            # ポリゴン
+            elif shape_type == pcbnew.S_POLYGON:
+                try:
+                    # ポリゴンの頂点を取得
+                    outline = drawing.GetPolyShape().Outline(0)
+                    coords = []
+                    for i in range(outline.PointCount()):
+                        point = outline.CPoint(i)
+                        coords.extend((point.x, point.y))
+                    shapes.append(("poly", edge_cut_layer) + tuple(coords))
+                except Exception as e:
+                    debug_info += f"ポリゴン処理エラー: {str(e)}\n"
+            
+            # その他の形状
+            else:
+                debug_info += f"未対応の形状タイプ: {shape_type}\n"
         
-        debug_info += f"検出されたセグメント数: {len(segments)}個\n"
+        return shapes, debug_info
+
+    def build_outline_from_shapes(self, shapes, chord_tolerance=ARC_CHORD_ERROR_DEFAULT):
+        """収集した図形を線分化・連結・フィレット処理して輪郭ごとの外形線（BoardOutline）を作成"""
+        debug_info = f"円弧の許容誤差: {chord_tolerance / 1000000:.4f}mm\n"
         
+        with self.diagnostics.phase("tessellate"):
+            segments = self.tessellate_shapes(shapes, chord_tolerance)
+        self.diagnostics.count("segments", len(segments))
+        debug_info += f"検出されたセグメント数: {len(segments)}個\n"
+
         if not segments:
             debug_info += "セグメントが検出されませんでした。\n"
             return [], debug_info
-            
-        # セグメントを連結して順序付き点のリストを作成
-        ordered_points = self.connect_segments_improved(segments)
-        debug_info += f"連結後の点の数: {len(ordered_points)}個\n"
-        
+
+        # セグメントを輪郭ごとに連結して順序付き点のリストを作成
+        with self.diagnostics.phase("chain"):
+            contours = self.connect_segments_improved(segments)
+        point_count = sum(len(contour) for contour in contours)
+        debug_info += f"連結後の点の数: {point_count}個\n"
+
         # 接続が成功したかチェック
-        if len(ordered_points) <= 1:
+        if point_count <= 1:
             debug_info += "セグメントの連結に失敗しました。\n"
             return [], debug_info
+
+        # 仮想的なフィレットを輪郭ごとに適用（0.1mm = 100,000 KiCadユニット）
+        with self.diagnostics.phase("fillet"):
+            outline = BoardOutline([self.apply_virtual_fillets(contour, 100000) for contour in contours])
+        self.diagnostics.count("outline_points", len(outline))
+        debug_info += outline.summary()
+
+        return outline, debug_info
+
+    def tessellate_shapes(self, shapes, chord_tolerance=ARC_CHORD_ERROR_DEFAULT):
+        """図形を (x1, y1, x2, y2) の線分のリストに変換（円弧・円は弦の誤差がchord_tolerance以下）"""
+        segments = []
         
-        # 仮想的なフィレットを適用（0.1mm = 100,000 KiCadユニット）
-        filleted_points = self.apply_virtual_fillets(ordered_points, 100000)
+        for shape in shapes:
+            kind = shape[0]
+            
+            if kind == "segment":
+                segments.append(shape[2:6])
+            
+            elif kind == "arc":
+                sx, sy, ex, ey, cx, cy = shape[2:]
+                
+                radius = math.sqrt((sx - cx)**2 + (sy - cy)**2)
+                start_angle = math.atan2(sy - cy, sx - cx)
+                end_angle = math.atan2(ey - cy, ex - cx)
+                if start_angle < 0:
+                    start_angle += 2 * math.pi
+                if end_angle < 0:
+                    end_angle += 2 * math.pi
+                
+                # KiCadの弧は常に反時計回り
+                if end_angle <= start_angle:
+                    end_angle += 2 * math.pi
+                
+                # 弦の誤差が許容値以下になるように分割（終点は元の座標を使う）
+                sweep = end_angle - start_angle
+                segment_count = self.arc_segment_count(radius, sweep, chord_tolerance)
+                last_x, last_y = sx, sy
+                for i in range(1, segment_count + 1):
+                    if i == segment_count:
+                        next_x, next_y = ex, ey
+                    else:
+                        angle = start_angle + sweep * i / segment_count
+                        next_x, next_y = cx + int(radius * math.cos(angle)), cy + int(radius * math.sin(angle))
+                    segments.append((last_x, last_y, next_x, next_y))
+                    last_x, last_y = next_x, next_y
+            
+            elif kind == "circle":
+                cx, cy, radius = shape[2:]
+                
+                # 円を弦の誤差が許容値以下になるように分割して線分として扱う
+                segment_count = self.arc_segment_count(radius, 2 * math.pi, chord_tolerance)
+                circle_points = [
+                    (cx + int(radius * math.cos(2 * math.pi * i / segment_count)),
+                     cy + int(radius * math.sin(2 * math.pi * i / segment_count)))
+                    for i in range(segment_count)
+                ]
+                for i in range(segment_count):
+                    segments.append(circle_points[i] + circle_points[(i + 1) % segment_count])
+            
+            elif kind == "rect":
+                x1, y1, x2, y2 = shape[2:]
+                
+                # 矩形の4つの辺を追加
+                segments.append((x1, y1, x2, y1))  # 上辺
+                segments.append((x2, y1, x2, y2))  # 右辺
+                segments.append((x2, y2, x1, y2))  # 下辺
+                segments.append((x1, y2, x1, y1))  # 左辺
+            
+            elif kind == "poly":
+                coords = shape[2:]
+                polygon = [coords[i:i + 2] for i in range(0, len(coords), 2)]
+                
+                # ポリゴンの各辺を追加
+                for i in range(len(polygon)):
+                    segments.append(polygon[i] + polygon[(i + 1) % len(polygon)])
         
-        return filleted_points, debug_info
+        return segments
+
+    def arc_segment_count(self, radius, sweep, tolerance):
+        """弦と円弧の最大誤差がtolerance以下になる分割数（1分割は最大45°）"""
+        if radius > tolerance:
+            angle_step = min(2 * math.acos(1 - tolerance / radius), math.pi / 4)
+        else:
+            angle_step = math.pi / 4
+        return max(1, int(math.ceil(sweep / angle_step)))
+
+    def chord_tolerance_for(self, radii):
+        """最小のVIA半径から円弧分割の許容誤差を決める"""
+        radii = [radius for radius in radii if radius > 0]
+        if not radii:
+            return ARC_CHORD_ERROR_DEFAULT
+        tolerance = min(radii) * ARC_CHORD_ERROR_RATIO
+        return int(min(max(tolerance, ARC_CHORD_ERROR_MIN), ARC_CHORD_ERROR_MAX))
 
     def connect_segments_improved(self, segments):
-        """改良版：セグメントを連結して順序付き点のリストを作成"""
+        """改良版：セグメントを連結して輪郭ごとの順序付き点のリストを作成"""
         if not segments:
             return []
 
-        # すべてのユニークな点を抽出（セグメントの端点）
-        all_points = []
-        for start, end in segments:
-            all_points.append((start.x, start.y))
-            all_points.append((end.x, end.y))
-        
-        # 重複を削除
-        unique_points = []
-        for point in all_points:
-            is_unique = True
-            for existing in unique_points:
-                if abs(point[0] - existing[0]) < 10000 and abs(point[1] - existing[1]) < 10000:
-                    is_unique = False
-                    break
-            if is_unique:
-                unique_points.append(point)
+        unique_points, paths = self.chain_segment_paths(segments)
         
         # 点が少なすぎる場合は失敗
-        if len(unique_points) < 3:
+        if len(unique_points) < 3 or not paths:
             return []
         
-        # 輪郭を形成する順序で点を整列
-        # 最も左上の点から開始
-        start_point = min(unique_points, key=lambda p: (p[0], p[1]))
-        ordered_points = [start_point]
-        remaining_points = [p for p in unique_points if p != start_point]
-        
-        # 最も近い点を常に次に選ぶ（時計回りまたは反時計回り）
-        while remaining_points:
-            current = ordered_points[-1]
-            
-            # 現在の点から最も近い点を選ぶ
-            closest = min(remaining_points, key=lambda p: (p[0] - current[0])**2 + (p[1] - current[1])**2)
-            ordered_points.append(closest)
-            remaining_points.remove(closest)
-            
-            # もし残りの点が1つだけで、それが開始点に近ければ、ループを閉じる
-            if len(remaining_points) == 1:
-                last_point = remaining_points[0]
-                first_point = ordered_points[0]
-                if (last_point[0] - first_point[0])**2 + (last_point[1] - first_point[1])**2 < 100000000:
-                    ordered_points.append(last_point)
-                    break
-        
-        # 単純なアルゴリズムがうまくいかない場合は、別のアプローチを試す
-        # 最初の点から時計回りに整列
-        if len(ordered_points) < len(unique_points) / 2:
-            # 最も左上の点を見つける
-            leftmost = min(unique_points, key=lambda p: p[0])
-            center_x = sum(p[0] for p in unique_points) / len(unique_points)
-            center_y = sum(p[1] for p in unique_points) / len(unique_points)
-            
-            # 中心からの角度でソート
-            def angle_from_center(point):
-                return math.atan2(point[1] - center_y, point[0] - center_x)
-                
-            ordered_points = sorted(unique_points, key=angle_from_center)
+        contours = []
+        for path in paths:
+            contour = [unique_points[i] for i in path]
+            
+            # 最初と最後の点が同じでない場合は閉じる
+            if len(contour) > 1 and not self.points_are_close(contour[0], contour[-1]):
+                contour.append(contour[0])
+            contours.append(contour)
         
-        # KiCadのVECTOR2Iオブジェクトに変換
-        result_points = [pcbnew.VECTOR2I(int(x), int(y)) for x, y in ordered_points]
+        return contours
+
+    def chain_segment_paths(self, segments, tolerance=10000):
+        """端点をハッシュグリッドで統合し、セグメントの接続関係をたどった経路を返す
+
+        戻り値は (統合後の点のリスト, 点インデックスの経路のリスト)。
+        閉じた輪郭の経路は開始点で終わる。
+        """
+        unique_points = []
+        cells = {}
         
-        # 最初と最後の点が同じでない場合は閉じる
-        if len(result_points) > 1 and not self.points_are_close(result_points[0], result_points[-1]):
-            result_points.append(result_points[0])
+        def snap(x, y):
+            cx, cy = x // tolerance, y // tolerance
+            for nx in (cx - 1, cx, cx + 1):
+                for ny in (cy - 1, cy, cy + 1):
+                    for index in cells.get((nx, ny), ()):
+                        ux, uy = unique_points[index]
+                        if abs(x - ux) < tolerance and abs(y - uy) < tolerance:
+                            return index
+            unique_points.append((x, y))
+            cells.setdefault((cx, cy), []).append(len(unique_points) - 1)
+            return len(unique_points) - 1
         
-        return result_points
+        # 接続グラフを構築（長さゼロの辺と重複する辺は除く）
+        adjacency = {}
+        edges = set()
+        for x1, y1, x2, y2 in segments:
+            a = snap(x1, y1)
+            b = snap(x2, y2)
+            if a == b or (min(a, b), max(a, b)) in edges:
+                continue
+            edges.add((min(a, b), max(a, b)))
+            adjacency.setdefault(a, []).append(b)
+            adjacency.setdefault(b, []).append(a)
+        
+        # 開いた経路の端（次数が奇数の点）から優先し、次に最も左上の点から辿る
+        start_order = sorted(adjacency, key=lambda i: (len(adjacency[i]) % 2 == 0, unique_points[i]))
+        paths = []
+        for start in start_order:
+            if not adjacency[start]:
+                continue
+            path = [start]
+            current = start
+            while adjacency[current]:
+                following = adjacency[current].pop()
+                adjacency[following].remove(current)
+                path.append(following)
+                current = following
+            paths.append(path)
+        
+        return unique_points, paths
 
     def apply_virtual_fillets(self, points, fillet_radius=100000):
         """直角部分に仮想的なフィレットを適用（0.1mm = 100,000 KiCadユニット）"""
@@ -330,10 +1885,11 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
             next_point = points[i + 1]
             
             # 2つのベクトルを計算
-            v1x = current_point.x - prev_point.x
-            v1y = current_point.y - prev_point.y
-            v2x = next_point.x - current_point.x
-            v2y = next_point.y - current_point.y
+            cx, cy = current_point
+            v1x = cx - prev_point[0]
+            v1y = cy - prev_point[1]
+            v2x = next_point[0] - cx
+            v2y = next_point[1] - cy
             
             # ベクトルの長さを計算
             v1_len = math.sqrt(v1x**2 + v1y**2)
@@ -358,15 +1914,8 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
                 radius = min(fillet_radius, v1_len / 2, v2_len / 2)
                 
                 # フィレット点の計算
-                p1 = pcbnew.VECTOR2I(
-                    int(current_point.x - v1x * radius),
-                    int(current_point.y - v1y * radius)
-                )
-                
-                p3 = pcbnew.VECTOR2I(
-                    int(current_point.x + v2x * radius),
-                    int(current_point.y + v2y * radius)
-                )
+                p1 = (int(cx - v1x * radius), int(cy - v1y * radius))
+                p3 = (int(cx + v2x * radius), int(cy + v2y * radius))
                 
                 # 結果に追加
                 result_points.append(p1)
@@ -376,10 +1925,9 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
                 for step in range(1, arc_steps + 1):
                     t = step / (arc_steps + 1)
                     # 簡易ベジェ曲線で円弧を近似
-                    px = (1-t)**2 * p1.x + 2*(1-t)*t * current_point.x + t**2 * p3.x
-                    py = (1-t)**2 * p1.y + 2*(1-t)*t * current_point.y + t**2 * p3.y
-                    arc_point = pcbnew.VECTOR2I(int(px), int(py))
-                    result_points.append(arc_point)
+                    px = (1-t)**2 * p1[0] + 2*(1-t)*t * cx + t**2 * p3[0]
+                    py = (1-t)**2 * p1[1] + 2*(1-t)*t * cy + t**2 * p3[1]
+                    result_points.append((int(px), int(py)))
                 
                 result_points.append(p3)
             else:
@@ -396,92 +1944,552 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
         return result_points
 
     def points_are_close(self, p1, p2, tolerance=10000):
-        """2点が近いか判定"""
-        return math.sqrt((p1.x - p2.x)**2 + (p1.y - p2.y)**2) < tolerance
+        """2点 (x, y) が近いか判定"""
+        return math.sqrt((p1[0] - p2[0])**2 + (p1[1] - p2[1])**2) < tolerance
 
-    def point_in_polygon(self, point, polygon):
-        """点が多角形の内側にあるかを判定（レイキャスティング法）"""
-        if not polygon or len(polygon) < 3:
-            return False
-        x, y = point.x, point.y
-        n = len(polygon)
-        inside = False
-        p1x, p1y = polygon[0].x, polygon[0].y
-        for i in range(n + 1):
-            p2x, p2y = polygon[i % n].x, polygon[i % n].y
-            if y > min(p1y, p2y):
-                if y <= max(p1y, p2y):
-                    if x <= max(p1x, p2x):
-                        if p1y != p2y:
-                            xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                        if p1x == p2x or x <= xinters:
-                            inside = not inside
-            p1x, p1y = p2x, p2y
-        return inside
+    def classify_vias(self, snapshot, outline, selected_only=False, progress=None, cancel=None):
+        """スナップショットのVIAを内側/外側/重複に分類（キャンセルされた場合はNone）
 
-    def distance_to_segment(self, point, segment_start, segment_end):
-        """点から線分までの最短距離を計算"""
-        x, y = point.x, point.y
-        x1, y1 = segment_start.x, segment_start.y
-        x2, y2 = segment_end.x, segment_end.y
-        A = x - x1
-        B = y - y1
-        C = x2 - x1
-        D = y2 - y1
-        dot = A * C + B * D
-        len_sq = C * C + D * D
-        if len_sq == 0:
-            return math.sqrt(A * A + B * B)
-        param = dot / len_sq
-        if param < 0:
-            xx = x1
-            yy = y1
-        elif param > 1:
-            xx = x2
-            yy = y2
-        else:
-            xx = x1 + param * C
-            yy = y1 + param * D
-        return math.sqrt((x - xx) ** 2 + (y - yy) ** 2)
-
-    def classify_vias(self, board, outline_points, selected_only=False):
-        """VIAを内側/外側/重複に分類"""
+        作業スレッドからも呼ぶため、pcbnewとwxは使わない。
+        """
         inside_vias, outside_vias, overlap_vias = [], [], []
-        if not outline_points or len(outline_points) < 3:
+        if not outline or len(outline) < 3:
             return [], [], []
         
-        vias = [track for track in board.Tracks() if track.Type() == pcbnew.PCB_VIA_T and (not selected_only or track.IsSelected())]
+        indices = snapshot.indices(selected_only)
+        codes = self.classify_via_records(snapshot.records(indices), outline, not selected_only,
+                                          progress, cancel)
+        if codes is None:
+            return None
+        items = snapshot.items
+        for i, code in zip(indices, codes):
+            if code == VIA_OVERLAP:
+                overlap_vias.append(items[i])
+            elif code == VIA_INSIDE:
+                inside_vias.append(items[i])
+            else:
+                outside_vias.append(items[i])
         
-        if selected_only and not vias:
-            wx.MessageBox("選択されたVIAが見つかりませんでした。", "警告", wx.ICON_WARNING)
-            return [], [], []
+        return inside_vias, outside_vias, overlap_vias
+
+    def classify_via_records(self, records, outline, complete=False, progress=None, cancel=None):
+        """(UUID, x, y, 幅) のVIAレコードを分類コードのリストに変換
+
+        completeがTrueの場合は基板上のすべてのVIAが渡されたものとして、
+        存在しなくなったVIAの保存済み結果を取り除く。
+        progress(処理済み数, 総数) を指定すると PROGRESS_CHUNK 個ごとに呼び出し、
+        cancel（threading.Event）がセットされた場合は保存済みの結果を変更せずに None を返す。
+        """
+        # 外形線が変わった場合は保存済みの分類結果を破棄
+        if self._via_results_outline is not outline:
+            self._via_results_outline = outline
+            self.via_results = {}
+        
+        # UUID・位置・幅が前回と同じVIAは保存済みの結果を使い、新規または変更されたVIAだけを計算
+        with self.diagnostics.phase("classify"):
+            codes = [self.via_results.get(record) for record in records]
+            pending = [i for i, code in enumerate(codes) if code is None]
+            
+            # 外形線から離れたVIAは事前判定で分類し、外形線の近くのVIAだけを厳密判定に回す
+            # （事前判定の作成にはVIA数によらない時間がかかるため、作成済みでなければVIAが多い場合だけ作る）
+            prefilter = None
+            if pending and (len(pending) >= PREFILTER_MIN_VIAS or self._outline_prefilter[0] is outline):
+                prefilter = self.outline_prefilter(outline)
+            field = None
+            if pending and self.use_distance_field:
+                field = self.distance_field(outline, min(records[i][3] for i in pending) // 2)
+            tier_counts = dict.fromkeys(OutlinePrefilter.TIERS, 0)
+            exact = []
+            for i in pending:
+                _uuid, x, y, width = records[i]
+                code, tier = (None, "prefilter_exact") if prefilter is None else prefilter.classify(x, y, width // 2)
+                if code is None and field is not None:
+                    code = field.classify(x, y, width // 2)
+                    if code is not None:
+                        tier = "distance_field"
+                tier_counts[tier] += 1
+                if code is None:
+                    exact.append(i)
+                else:
+                    codes[i] = code
+            for tier, count in tier_counts.items():
+                self.diagnostics.count(tier, count)
+            
+            if exact:
+                positions = [records[i][1:3] for i in exact]
+                radii = [records[i][3] // 2 for i in exact]
+                reused = len(records) - len(exact)
+                if self.can_classify_in_parallel(len(exact)):
+                    pending_codes = self.classify_positions_parallel(
+                        positions, radii, outline,
+                        None if progress is None else lambda done: progress(reused + done, len(records)), cancel)
+                    if pending_codes is None:
+                        return None
+                else:
+                    step = PROGRESS_CHUNK if progress is not None or cancel is not None else len(exact)
+                    pending_codes = []
+                    for begin in range(0, len(exact), step):
+                        if cancel is not None and cancel.is_set():
+                            return None
+                        pending_codes.extend(self.classify_positions(
+                            positions[begin:begin + step], radii[begin:begin + step], outline))
+                        if progress is not None:
+                            progress(reused + len(pending_codes), len(records))
+                for i, code in zip(exact, pending_codes):
+                    codes[i] = code
+        self.diagnostics.count("vias", len(records))
+        self.diagnostics.count("vias_computed", len(pending))
+        self.diagnostics.count("vias_reused", len(records) - len(pending))
+        
+        if complete:
+            self.via_results = dict(zip(records, codes))
+        else:
+            self.via_results.update(zip(records, codes))
+        return codes
+
+    def classify_regions(self, records, regions, progress=None, cancel=None):
+        """(UUID, x, y, 幅) のVIAレコードを複数の領域（ReferenceRegion）に対して1回の走査で分類
+
+        VIAごとのビットマスクを返す（領域が32個以下なら array("Q")）。regions[k] について、
+        ビット2kは内側、ビット2k+1は重複で、どちらも立っていなければ外側（region_codeで取り出せる）。
+        複数の外形線からなる領域は外形線ごとに判定して和集合をとる（ReferenceRegion）。
+        同じ外形線の領域（基板外形と縁からのクリアランスなど）は事前判定・内外判定・インデックスを共有し、
+        重複判定はクリアランスの大きい領域から調べて、重ならなければ残りの領域は調べない。
+        すべての領域の外接矩形を1つの粗い格子に登録し、VIAごとに近くにある領域だけを調べる。
+        cancel（threading.Event）がセットされた場合は None を返す。
+        """
+        # 外形線ごとに (事前判定, インデックス, [(クリアランス, 領域の番号), ...]) をまとめる
+        groups = OrderedDict()
+        for bit, region in enumerate(regions):
+            for part in region.parts:
+                groups.setdefault(id(part), (part, []))[1].append((region.clearance, bit))
+        cache = {}
+        plan = []
+        for key, (outline, members) in groups.items():
+            cached = self._region_cache.get(key)
+            if cached is None or cached[0] is not outline:
+                # キープアウトやコートヤードのような辺の少ない領域は、事前判定の格子を辺の数に応じて小さくする
+                edge_count = len(outline.edges)
+                grid_size = 8 if edge_count < INDEX_MIN_EDGES else min(PREFILTER_GRID_SIZE, 16 * math.isqrt(edge_count) + 16)
+                cached = (outline, OutlinePrefilter(outline, grid_size), OutlineIndex(outline))
+            cache[key] = cached
+            members.sort(reverse=True)
+            plan.append((cached[1], cached[2], members))
+        self._region_cache = cache
+        
+        # 各領域の外接矩形を最大のVIA半径とクリアランスだけ広げて格子に登録（格子の外のVIAはすべての領域の外側）
+        reach = max((record[3] // 2 for record in records), default=0) + 1
+        boxes = [(prefilter.min_x - reach - members[0][0], prefilter.min_y - reach - members[0][0],
+                  prefilter.max_x + reach + members[0][0], prefilter.max_y + reach + members[0][0])
+                 for prefilter, _index, members in plan]
+        grid = {}
+        if boxes:
+            min_x, min_y = min(box[0] for box in boxes), min(box[1] for box in boxes)
+            cell_size = max(max(box[2] for box in boxes) - min_x, max(box[3] for box in boxes) - min_y) / REGION_GRID_SIZE
+            cell_size = max(cell_size, 1)
+            for number, (x1, y1, x2, y2) in enumerate(boxes):
+                for column in range(int((x1 - min_x) // cell_size), int((x2 - min_x) // cell_size) + 1):
+                    for row in range(int((y1 - min_y) // cell_size), int((y2 - min_y) // cell_size) + 1):
+                        grid.setdefault((column, row), []).append(plan[number])
         
-        for via in vias:
-            position = via.GetPosition()
-            via_diameter = via.GetWidth()
-            via_radius = via_diameter // 2
-            is_inside = self.point_in_polygon(position, outline_points)
-            is_overlapping = False
-            
-            for i in range(len(outline_points) - 1):
-                start_point = outline_points[i]
-                end_point = outline_points[i + 1]
-                dist = self.distance_to_segment(position, start_point, end_point)
-                if dist <= via_radius:
-                    is_overlapping = True
-                    break
-            
-            if is_overlapping:
-                overlap_vias.append(via)
-            elif is_inside:
-                inside_vias.append(via)
+        masks = array("Q") if len(regions) <= 32 else []
+        exact = 0
+        tested = 0
+        with self.diagnostics.phase("classify_regions"):
+            for begin in range(0, len(records), PROGRESS_CHUNK):
+                if cancel is not None and cancel.is_set():
+                    return None
+                for _uuid, x, y, width in records[begin:begin + PROGRESS_CHUNK]:
+                    radius = width // 2
+                    mask = 0  # 内側のビット
+                    overlap_mask = 0  # 重複のビット（和集合の領域では、別の外形線の内側なら内側を優先する）
+                    nearby = grid.get((int((x - min_x) // cell_size), int((y - min_y) // cell_size)), ()) if grid else ()
+                    tested += len(nearby)
+                    for prefilter, index, members in nearby:
+                        # 最大のクリアランスでも外形線から離れていれば、すべての領域で内外だけが決まる
+                        code, _tier = prefilter.classify(x, y, radius + members[0][0])
+                        if code is not None:
+                            if code == VIA_INSIDE:
+                                for _clearance, bit in members:
+                                    mask |= 1 << (2 * bit)
+                            continue
+                        exact += 1
+                        inside = index.point_inside(x, y)
+                        overlapping = True
+                        for clearance, bit in members:
+                            if overlapping and index.overlaps(x, y, radius + clearance):
+                                overlap_mask |= 2 << (2 * bit)
+                            else:
+                                overlapping = False
+                                if inside:
+                                    mask |= 1 << (2 * bit)
+                    masks.append(mask | (overlap_mask & ~(mask << 1)))
+                if progress is not None:
+                    progress(len(masks), len(records))
+        self.diagnostics.count("region_vias", len(records))
+        self.diagnostics.count("region_outline_tests", tested)
+        self.diagnostics.count("region_exact", exact)
+        return masks
+
+    def reference_regions(self, outline, board=None, chord_tolerance=ARC_CHORD_ERROR_DEFAULT, edge_clearance=None):
+        """classify_regions用の領域のリストとデバッグ情報を作成
+
+        基板外形（outline）と、縁からのクリアランス（edge_clearance、Noneなら基板の設計ルールの値）の領域に加えて、
+        boardを指定した場合はVIA禁止のキープアウト（ルールエリア）ごとの領域と表・裏のコートヤードの領域を、
+        外形線と同じ処理（線分化・連結・フィレット）で作成する。
+        """
+        regions = [ReferenceRegion("Edge.Cuts", outline)]
+        debug_info = ""
+        if edge_clearance is None and board is not None:
+            try:
+                edge_clearance = board.GetDesignSettings().m_CopperEdgeClearance
+            except AttributeError:
+                edge_clearance = None
+        if edge_clearance:
+            regions.append(ReferenceRegion("edge_clearance", outline, int(edge_clearance)))
+        if board is None:
+            return regions, debug_info
+        
+        for number, zone in enumerate(board.Zones()):
+            if not (zone.GetIsRuleArea() and zone.GetDoNotAllowVias()):
+                continue
+            name = zone.GetZoneName() or str(number)
+            zone_outline, zone_debug_info = self.get_outline_from_shapes(
+                self.poly_set_shapes(zone.Outline(), zone.GetLayer()), None, chord_tolerance)
+            debug_info += f"キープアウト {name}:\n" + zone_debug_info
+            if zone_outline:
+                regions.append(ReferenceRegion(f"keepout:{name}", zone_outline))
+        
+        # コートヤードは重なったり接したりするため、フットプリントごとの外形線の和集合を1つの領域にする
+        footprints = list(board.GetFootprints())
+        for layer_name in ("F_CrtYd", "B_CrtYd"):
+            layer = getattr(pcbnew, layer_name)
+            courtyards = []
+            failed = []
+            for footprint in footprints:
+                shapes, _shape_debug_info = self.collect_edge_shapes(board, layer, footprint.GraphicalItems())
+                if not shapes:
+                    continue
+                courtyard, _courtyard_debug_info = self.get_outline_from_shapes(shapes, None, chord_tolerance)
+                if courtyard:
+                    courtyards.append(courtyard)
+                else:
+                    failed.append(footprint.GetReference())
+            if not courtyards and not failed:
+                continue
+            debug_info += f"コートヤード {layer_name}: {len(courtyards)}個のフットプリント\n"
+            if failed:
+                debug_info += f"  外形線を作成できないコートヤード: {', '.join(failed)}\n"
+            if courtyards:
+                regions.append(ReferenceRegion(f"courtyard:{layer_name}", courtyards))
+        return regions, debug_info
+
+    def poly_set_shapes(self, poly, layer):
+        """SHAPE_POLY_SETの輪郭（外周と穴）を collect_edge_shapes と同じ形式の "poly" 図形のリストに変換"""
+        shapes = []
+        for outline in range(poly.OutlineCount()):
+            chains = [poly.Outline(outline)]
+            if hasattr(poly, "HoleCount"):
+                chains.extend(poly.Hole(outline, hole) for hole in range(poly.HoleCount(outline)))
+            for chain in chains:
+                coords = []
+                for i in range(chain.PointCount()):
+                    point = chain.CPoint(i)
+                    coords.extend((point.x, point.y))
+                shapes.append(("poly", layer) + tuple(coords))
+        return shapes
+
+    def hole_clearance_for(self, board):
+        """設計ルールの穴と穴の間隔の最小値（取得できない場合は VIA_HOLE_CLEARANCE_DEFAULT）"""
+        try:
+            clearance = board.GetDesignSettings().m_HoleToHoleMin
+        except AttributeError:
+            clearance = 0
+        return int(clearance) if clearance and clearance > 0 else VIA_HOLE_CLEARANCE_DEFAULT
+
+    def analyze_via_proximity(self, snapshot, indices, clearance, progress=None, cancel=None):
+        """スナップショットのVIA（indicesの順）から、穴と穴の間隔がclearance未満の組を検出してViaProximityを返す
+
+        セル幅を clearance + 最大の穴径 とした格子（空間ハッシュ）で周囲9セルのVIAとだけ比べるため、
+        VIAが極端に密集していなければVIA数にほぼ比例する時間で終わる（NumPyがあれば一括で比べる）。
+        層の範囲が重ならない組（端の層を共有するだけの積層マイクロビアなど）は対象外とする。
+        削除候補は走査順に、残すVIAと組になるVIAを選ぶ（先のVIAを残す）。
+        cancel（threading.Event）がセットされた場合は None を返す。
+        """
+        result = ViaProximity(clearance)
+        drills = snapshot.drills
+        cell_size = clearance + max((drills[i] for i in indices), default=0) + 1
+        with self.diagnostics.phase("via_proximity"):
+            if np is not None:
+                found = self._proximity_pairs_batch(snapshot, indices, clearance, cell_size, progress, cancel)
             else:
-                outside_vias.append(via)
+                found = self._proximity_pairs(snapshot, indices, clearance, cell_size, progress, cancel)
+            if found is None:
+                return None
+            
+            # found は後のVIAの走査順に並んでいるため、先のVIAを残すかどうかは後のVIAより先に決まる
+            duplicate_sq = VIA_DUPLICATE_TOLERANCE * VIA_DUPLICATE_TOLERANCE
+            removable = set()
+            parent = {}  # 組でつながるVIAのunion-find
+            
+            def find(i):
+                while parent[i] != i:
+                    parent[i] = parent[parent[i]]
+                    i = parent[i]
+                return i
+            
+            for j, i, distance_sq in found:
+                result.pairs.append((j, i, int(round(math.sqrt(distance_sq) - (drills[i] + drills[j]) / 2))))
+                if distance_sq <= duplicate_sq:
+                    result.duplicates += 1
+                if j not in removable and i not in removable:
+                    removable.add(i)
+                    result.removable.append(i)
+                parent.setdefault(j, j)
+                parent[find(parent.setdefault(i, i))] = find(j)
+            
+            clusters = OrderedDict()
+            for i in indices:
+                if i in parent:
+                    clusters.setdefault(find(i), []).append(i)
+            result.clusters = list(clusters.values())
+        self.diagnostics.count("proximity_pairs", len(result.pairs))
+        return result
+
+    def _layer_order(self, layer):
+        """銅箔層の表面からの順序（KiCadの層番号では裏面の銅箔層だけが内層より小さい）"""
+        return 1 << 30 if layer == pcbnew.B_Cu else layer
+
+    def _proximity_pairs(self, snapshot, indices, clearance, cell_size, progress=None, cancel=None):
+        """近接するVIAの組 (先のVIA, 後のVIA, 中心間の距離の2乗) のリスト（VIAを順に格子に登録して前のVIAと比べる）"""
+        xs, ys, drills = snapshot.xs, snapshot.ys, snapshot.drills
+        tops, bottoms = snapshot.top_layers, snapshot.bottom_layers
+        # セルのキーは 列 × 2^32 + 行（KiCadの座標は32ビットのため行は重ならない）
+        neighbors = [column * (1 << 32) + row for column in (-1, 0, 1) for row in (-1, 0, 1)]
+        grid = {}
+        found = []
+        candidates = 0
+        for begin in range(0, len(indices), PROGRESS_CHUNK):
+            if cancel is not None and cancel.is_set():
+                return None
+            for i in indices[begin:begin + PROGRESS_CHUNK]:
+                x, y, drill = xs[i], ys[i], drills[i]
+                key = int(x // cell_size) * (1 << 32) + int(y // cell_size)
+                for offset in neighbors:
+                    bucket = grid.get(key + offset)
+                    if bucket is None:
+                        continue
+                    candidates += len(bucket)
+                    for j in bucket:
+                        dx, dy = xs[j] - x, ys[j] - y
+                        distance_sq = dx * dx + dy * dy
+                        reach = (drill + drills[j]) / 2 + clearance
+                        if distance_sq >= reach * reach:
+                            continue
+                        top_i, bottom_i = sorted((self._layer_order(tops[i]), self._layer_order(bottoms[i])))
+                        top_j, bottom_j = sorted((self._layer_order(tops[j]), self._layer_order(bottoms[j])))
+                        if max(top_i, top_j) < min(bottom_i, bottom_j):
+                            found.append((j, i, distance_sq))
+                bucket = grid.get(key)
+                if bucket is None:
+                    grid[key] = [i]
+                else:
+                    bucket.append(i)
+            if progress is not None:
+                progress(min(begin + PROGRESS_CHUNK, len(indices)), len(indices))
+        self.diagnostics.count("proximity_candidates", candidates)
+        return found
+
+    def _proximity_pairs_batch(self, snapshot, indices, clearance, cell_size, progress=None, cancel=None):
+        """_proximity_pairs のNumPy版（セルのキーで並べ替え、周囲9セルの範囲をまとめて展開して比べる）"""
+        order = np.asarray(indices, dtype=np.int64)
+        xs = np.frombuffer(snapshot.xs, dtype=np.int64)[order]
+        ys = np.frombuffer(snapshot.ys, dtype=np.int64)[order]
+        drills = np.frombuffer(snapshot.drills, dtype=np.int64)[order]
+        tops = np.array(snapshot.top_layers, dtype=np.int64)[order]
+        bottoms = np.array(snapshot.bottom_layers, dtype=np.int64)[order]
+        tops = np.where(tops == pcbnew.B_Cu, 1 << 30, tops)
+        bottoms = np.where(bottoms == pcbnew.B_Cu, 1 << 30, bottoms)
+        tops, bottoms = np.minimum(tops, bottoms), np.maximum(tops, bottoms)
         
-        return inside_vias, outside_vias, overlap_vias
+        keys = (xs // cell_size) * (1 << 32) + ys // cell_size
+        by_cell = np.argsort(keys, kind="stable")
+        sorted_keys = keys[by_cell]
+        neighbors = [column * (1 << 32) + row for column in (-1, 0, 1) for row in (-1, 0, 1)]
+        earlier_parts, later_parts, distance_parts = [], [], []
+        candidates = 0
+        count = len(order)
+        for begin in range(0, count, PROGRESS_CHUNK):
+            if cancel is not None and cancel.is_set():
+                return None
+            # セルのキーの順に処理すると探すキーも昇順になり、searchsortedが速い
+            later_chunk = by_cell[begin:begin + PROGRESS_CHUNK]
+            chunk_keys = sorted_keys[begin:begin + PROGRESS_CHUNK]
+            for offset in neighbors:
+                target = chunk_keys + offset
+                low = np.searchsorted(sorted_keys, target, "left")
+                counts = np.searchsorted(sorted_keys, target, "right") - low
+                total = int(counts.sum())
+                if total == 0:
+                    continue
+                # 各VIAの対象セルの範囲 [low, low + counts) を1つの配列に展開
+                later = np.repeat(later_chunk, counts)
+                within = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+                earlier = by_cell[np.repeat(low, counts) + within]
+                keep = earlier < later
+                earlier, later = earlier[keep], later[keep]
+                candidates += len(earlier)
+                dx = xs[earlier] - xs[later]
+                dy = ys[earlier] - ys[later]
+                distance_sq = dx * dx + dy * dy
+                reach = (drills[earlier] + drills[later]) / 2 + clearance
+                keep = ((distance_sq < reach * reach)
+                        & (np.maximum(tops[earlier], tops[later]) < np.minimum(bottoms[earlier], bottoms[later])))
+                earlier_parts.append(earlier[keep])
+                later_parts.append(later[keep])
+                distance_parts.append(distance_sq[keep])
+            if progress is not None:
+                progress(min(begin + PROGRESS_CHUNK, count), count)
+        self.diagnostics.count("proximity_candidates", candidates)
+        if not earlier_parts:
+            return []
+        
+        earlier = np.concatenate(earlier_parts)
+        later = np.concatenate(later_parts)
+        distance_sq = np.concatenate(distance_parts)
+        by_pair = np.lexsort((earlier, later))
+        return list(zip(order[earlier[by_pair]].tolist(), order[later[by_pair]].tolist(),
+                        distance_sq[by_pair].tolist()))
 
-    def show_unified_dialog(self, board, inside_vias, outside_vias, overlap_vias, selected_vias_count, edge_points, debug_info=""):
+    def outline_prefilter(self, outline):
+        """外形線の事前判定（同じ外形線のリストなら作成済みのものを再利用）"""
+        if self._outline_prefilter[0] is not outline:
+            self._outline_prefilter = (outline, OutlinePrefilter(outline))
+        return self._outline_prefilter[1]
+
+    def distance_field(self, outline, min_radius):
+        """外形線の符号付き距離場（外形線が変わった場合だけ作り直す）"""
+        if self._distance_field[0] is not outline:
+            with self.diagnostics.phase("distance_field"):
+                field = DistanceField(outline, max(min_radius, ARC_CHORD_ERROR_MIN))
+            self._distance_field = (outline, field)
+        return self._distance_field[1]
+
+    def classify_positions(self, positions, radii, outline):
+        """座標(x, y)と半径のリストを分類コードのリストに変換"""
+        if not positions:
+            return []
+        if np is not None and len(outline.edges) < INDEX_MIN_EDGES:
+            # 一括分類ではすべての辺を交差判定と距離判定の両方で調べる
+            self.diagnostics.count("edges_tested", 2 * len(positions) * len(outline.edges))
+            return self.classify_positions_batch(positions, radii, outline)
+        
+        index = self.outline_index(outline)
+        edges_tested = index.edges_tested
+        codes = [index.classify(x, y, via_radius) for (x, y), via_radius in zip(positions, radii)]
+        self.diagnostics.count("edges_tested", index.edges_tested - edges_tested)
+        return codes
+
+    def outline_index(self, outline):
+        """外形線の空間インデックス（同じ外形線（キャッシュ済みのオブジェクト）なら再利用）"""
+        if self._outline_index[0] is not outline:
+            self._outline_index = (outline, OutlineIndex(outline))
+        return self._outline_index[1]
+
+    def can_classify_in_parallel(self, count):
+        """count個のVIAをclassify_positions_parallelで分類するかどうか（ヘッドレス実行時のみ）"""
+        return self.parallel_processes and self.parallel_workers > 1 and count >= PARALLEL_MIN_VIAS
+
+    def classify_positions_parallel(self, positions, radii, outline, progress=None, cancel=None):
+        """VIAをチャンクに分けてワーカープロセスで並列に分類し、元の順序で結合する（結果は直列の分類と同じ）
+
+        各ワーカーが初期化時に外形線を1回だけ受け取ってインデックスを作り、すべてのチャンクで共有する。progress(処理済み数) はチャンクが完了するたびに呼び出し、
+        cancel（threading.Event）がセットされた場合は残りのチャンクを取り消して None を返す。
+        """
+        workers = self.parallel_workers
+        step = max(PROGRESS_CHUNK, -(-len(positions) // (workers * PARALLEL_CHUNKS_PER_WORKER)))
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_parallel_worker,
+                                       initargs=(outline.xs, outline.ys, outline.starts))
+        codes = []
+        edges_tested = 0
+        try:
+            futures = [executor.submit(_classify_parallel_chunk, positions[begin:begin + step], radii[begin:begin + step])
+                       for begin in range(0, len(positions), step)]
+            for future in futures:
+                if cancel is not None and cancel.is_set():
+                    return None
+                chunk_codes, chunk_edges_tested = future.result()
+                codes.extend(chunk_codes)
+                edges_tested += chunk_edges_tested
+                if progress is not None:
+                    progress(len(codes))
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        
+        self.diagnostics.count("parallel_chunks", len(futures))
+        self.diagnostics.count("edges_tested", edges_tested)
+        return codes
+
+    def classify_positions_batch(self, positions, radii, outline):
+        """NumPyで全VIAを一括分類（OutlineIndexと同じ交差判定と距離判定）"""
+        via_xy = np.array(positions, dtype=np.int64).reshape(-1, 2)
+        via_r = np.array(radii, dtype=np.float64)
+        
+        # 全輪郭の辺（各輪郭の閉じる辺を含む）を交差判定と距離判定の両方に使う
+        ax = np.frombuffer(outline.xs, dtype=np.int64)
+        ay = np.frombuffer(outline.ys, dtype=np.int64)
+        starts = np.frombuffer(outline.starts, dtype=np.int64)
+        following = np.arange(1, len(ax) + 1)
+        following[starts[1:] - 1] = starts[:-1]
+        bx, by = ax[following], ay[following]
+        edge_ymin = np.minimum(ay, by)
+        edge_ymax = np.maximum(ay, by)
+        edge_xmax = np.maximum(ax, bx)
+        edge_dy = by - ay
+        edge_vertical = ax == bx
+        safe_dy = np.where(edge_dy == 0, 1, edge_dy)
+        
+        sx1, sy1 = ax, ay
+        sc, sd = bx - ax, by - ay
+        len_sq = sc * sc + sd * sd
+        safe_len_sq = np.where(len_sq == 0, 1, len_sq)
+        
+        codes = np.empty(len(via_xy), dtype=np.int8)
+        chunk = max(1, BATCH_CELL_LIMIT // max(1, len(ax)))
+        for begin in range(0, len(via_xy), chunk):
+            px = via_xy[begin:begin + chunk, 0:1]
+            py = via_xy[begin:begin + chunk, 1:2]
+            
+            # 交差数判定
+            crossing = (py > edge_ymin) & (py <= edge_ymax) & (px <= edge_xmax)
+            xinters = (py - ay) * (bx - ax) / safe_dy + ax
+            crossing &= edge_vertical | (px <= xinters)
+            is_inside = (np.count_nonzero(crossing, axis=1) & 1).astype(bool)
+            
+            # 線分までの最短距離
+            A = px - sx1
+            B = py - sy1
+            param = np.where(len_sq == 0, 0.0, (A * sc + B * sd) / safe_len_sq)
+            np.clip(param, 0.0, 1.0, out=param)
+            dist = np.hypot(A - param * sc, B - param * sd)
+            if dist.shape[1]:
+                is_overlapping = (dist <= via_r[begin:begin + chunk, None]).any(axis=1)
+            else:
+                is_overlapping = np.zeros(len(px), dtype=bool)
+            
+            codes[begin:begin + chunk] = np.where(
+                is_overlapping, VIA_OVERLAP, np.where(is_inside, VIA_INSIDE, VIA_OUTSIDE))
+        
+        return codes.tolist()
+
+    def show_unified_dialog(self, board, snapshot, inside_vias, outside_vias, overlap_vias, edge_points, debug_info="",
+                            proximity=None):
         """処理範囲の選択と結果表示を統合したダイアログ"""
+        selected_vias_count = snapshot.selected_count
+        if proximity is None:
+            proximity = ViaProximity(self.hole_clearance_for(board))
+        # 近接・重複するVIAのうち削除候補（各組の先のVIAは残す）
+        close_vias = [snapshot.items[i] for i in proximity.removable]
         dialog = wx.Dialog(None, title="VIA分類ツール", size=(480, 500))
         vbox = wx.BoxSizer(wx.VERTICAL)
         
@@ -509,10 +2517,12 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
         outside_text = wx.StaticText(dialog, label=f"外側のVIA: {len(outside_vias)}個")
         overlap_text = wx.StaticText(dialog, label=f"外形線と重複するVIA: {len(overlap_vias)}個")
         total_text = wx.StaticText(dialog, label=f"合計: {total_vias}個のVIA")
+        proximity_text = wx.StaticText(dialog, label="")
         results_box.Add(inside_text, flag=wx.LEFT, border=20)
         results_box.Add(outside_text, flag=wx.LEFT, border=20)
         results_box.Add(overlap_text, flag=wx.LEFT, border=20)
         results_box.Add(total_text, flag=wx.LEFT, border=20)
+        results_box.Add(proximity_text, flag=wx.LEFT|wx.TOP, border=20)
         vbox.Add(results_box, flag=wx.EXPAND|wx.ALL, border=5)
         
         # 削除オプション
@@ -524,37 +2534,41 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
         chk_inside = wx.CheckBox(dialog, label=f"内側のVIA ({len(inside_vias)}個)")
         chk_outside = wx.CheckBox(dialog, label=f"外側のVIA ({len(outside_vias)}個)")
         chk_overlap = wx.CheckBox(dialog, label=f"重複するVIA ({len(overlap_vias)}個)")
+        chk_close = wx.CheckBox(dialog, label="")
         delete_box.Add(chk_inside, flag=wx.LEFT, border=20)
         delete_box.Add(chk_outside, flag=wx.LEFT, border=20)
         delete_box.Add(chk_overlap, flag=wx.LEFT, border=20)
+        delete_box.Add(chk_close, flag=wx.LEFT, border=20)
         vbox.Add(delete_box, flag=wx.EXPAND|wx.ALL, border=5)
         
         # 削除警告
-        delete_warning = wx.StaticText(dialog, label="※削除操作は元に戻せません")
+        delete_warning = wx.StaticText(dialog, label="※削除はツールを閉じた後、Ctrl+Zでまとめて元に戻せます")
         delete_warning.SetForegroundColour(wx.RED)
         vbox.Add(delete_warning, flag=wx.EXPAND|wx.LEFT|wx.TOP, border=20)
         
+        # 結果一覧ボタン
+        browse_btn = wx.Button(dialog, label="VIAの一覧を表示（絞り込み・ズーム・個別削除）")
+        vbox.Add(browse_btn, flag=wx.EXPAND|wx.LEFT|wx.RIGHT|wx.TOP, border=10)
+        
         # デバッグ情報ボタン
         debug_btn = wx.Button(dialog, label="診断情報を表示")
         vbox.Add(debug_btn, flag=wx.EXPAND|wx.LEFT|wx.RIGHT|wx.TOP, border=10)
-        debug_btn.Bind(wx.EVT_BUTTON, lambda evt: self.show_debug_dialog("診断情報", debug_info))
+        debug_btn.Bind(wx.EVT_BUTTON, lambda evt: self.show_debug_dialog(
+            "診断情報", debug_info + self.diagnostics.format_text(), self.diagnostics.to_dict(debug_info)))
         
         # ボタン
         btn_box = wx.BoxSizer(wx.HORIZONTAL)
         btn_delete = wx.Button(dialog, label="選択したVIAを削除")
         btn_delete.SetForegroundColour(wx.RED)
         btn_close = wx.Button(dialog, wx.ID_CLOSE, "閉じる")
+        btn_live = wx.Button(dialog, wx.ID_APPLY, "ライブモードを開始")
         btn_box.Add(btn_delete, flag=wx.RIGHT, border=5)
+        btn_box.Add(btn_live, flag=wx.RIGHT, border=5)
         btn_box.Add(btn_close, flag=wx.RIGHT, border=5)
         vbox.Add(btn_box, flag=wx.ALIGN_CENTER|wx.ALL, border=10)
         
-        # 処理範囲変更時の再分類
-        def on_scope_change(evt):
-            use_selection_only = scope_choice.GetSelection() == 0
-            inside_vias_new, outside_vias_new, overlap_vias_new = self.classify_vias(board, edge_points, use_selection_only)
-            inside_vias[:] = inside_vias_new
-            outside_vias[:] = outside_vias_new
-            overlap_vias[:] = overlap_vias_new
+        # 件数表示の更新
+        def update_labels():
             total_vias_new = len(inside_vias) + len(outside_vias) + len(overlap_vias)
             inside_text.SetLabel(f"内側のVIA: {len(inside_vias)}個")
             outside_text.SetLabel(f"外側のVIA: {len(outside_vias)}個")
@@ -563,32 +2577,259 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
             chk_inside.SetLabel(f"内側のVIA ({len(inside_vias)}個)")
             chk_outside.SetLabel(f"外側のVIA ({len(outside_vias)}個)")
             chk_overlap.SetLabel(f"重複するVIA ({len(overlap_vias)}個)")
+            proximity_text.SetLabel(f"近接・重複するVIAの組: {len(proximity.pairs)}組（同じ位置 {proximity.duplicates}組、"
+                                    f"穴の間隔 {proximity.clearance / 1000000:.3f}mm未満）")
+            chk_close.SetLabel(f"近接・重複するVIA ({len(close_vias)}個、各組の先のVIAは残す)")
             dialog.Layout()
         
+        update_labels()
+        
+        # 近接・重複するVIAの削除候補を差し替える
+        def set_proximity(proximity_new):
+            nonlocal proximity
+            proximity = proximity_new
+            close_vias[:] = [snapshot.items[i] for i in proximity.removable]
+        
+        # 処理範囲変更時の再分類
+        def on_scope_change(evt):
+            use_selection_only = scope_choice.GetSelection() == 0
+            if use_selection_only and snapshot.selected_count == 0:
+                wx.MessageBox("選択されたVIAが見つかりませんでした。", "警告", wx.ICON_WARNING)
+                result = ([], [], []), ViaProximity(proximity.clearance)
+            else:
+                def work(progress, cancel):
+                    classified = self.classify_vias(snapshot, edge_points, use_selection_only,
+                                                    self.via_progress(progress, 0, 90), cancel)
+                    if classified is None:
+                        return None
+                    progress(90, "近接・重複するVIAを検出中...")
+                    return classified, self.analyze_via_proximity(
+                        snapshot, snapshot.indices(use_selection_only), proximity.clearance, None, cancel)
+                
+                result = self.run_in_background("VIAを分類中...", work)
+                if result is None:
+                    # キャンセルされた場合は前の処理範囲と結果に戻す
+                    scope_choice.SetSelection(1 if use_selection_only else 0)
+                    return
+            (inside_vias_new, outside_vias_new, overlap_vias_new), proximity_new = result
+            inside_vias[:] = inside_vias_new
+            outside_vias[:] = outside_vias_new
+            overlap_vias[:] = overlap_vias_new
+            set_proximity(proximity_new)
+            update_labels()
+        
+        # 削除したVIAを結果から取り除く
+        def forget_deleted(deleted_vias):
+            nonlocal snapshot
+            # 処理範囲を切り替えたときに削除済みのVIAを参照しないよう、スナップショットからも取り除く
+            snapshot = snapshot.without(deleted_vias)
+            scope_choice.SetString(0, f"選択されたVIAのみ ({snapshot.selected_count}個)")
+            removed = set(id(via) for via in deleted_vias)
+            for vias in (inside_vias, outside_vias, overlap_vias):
+                vias[:] = [via for via in vias if id(via) not in removed]
+            # 残したVIAが削除された組もあるため、近接・重複は残りのVIAで検出し直す
+            set_proximity(self.analyze_via_proximity(
+                snapshot, snapshot.indices(scope_choice.GetSelection() == 0), proximity.clearance))
+            update_labels()
+        
+        def on_delete(evt):
+            targets = [(chk_inside, inside_vias), (chk_outside, outside_vias), (chk_overlap, overlap_vias),
+                       (chk_close, close_vias)]
+            selected_targets = [vias if chk.GetValue() else [] for chk, vias in targets]
+            if self.delete_selected_vias(board, *selected_targets):
+                forget_deleted([via for vias in selected_targets for via in vias])
+                for chk, _vias in targets:
+                    chk.SetValue(False)
+        
+        # 結果一覧（仮想リスト）
+        def on_browse(evt):
+            self.show_results_browser(
+                board, snapshot, [(VIA_INSIDE, inside_vias), (VIA_OUTSIDE, outside_vias), (VIA_OVERLAP, overlap_vias)],
+                edge_points, forget_deleted)
+        
         scope_choice.Bind(wx.EVT_CHOICE, on_scope_change)
-        btn_delete.Bind(wx.EVT_BUTTON, lambda evt: self.delete_selected_vias(
-            board, 
-            inside_vias if chk_inside.GetValue() else [], 
-            outside_vias if chk_outside.GetValue() else [], 
-            overlap_vias if chk_overlap.GetValue() else []
-        ))
+        btn_delete.Bind(wx.EVT_BUTTON, on_delete)
+        browse_btn.Bind(wx.EVT_BUTTON, on_browse)
+        btn_live.Bind(wx.EVT_BUTTON, lambda evt: dialog.EndModal(wx.ID_APPLY))
         btn_close.Bind(wx.EVT_BUTTON, lambda evt: dialog.EndModal(wx.ID_CLOSE))
         
         dialog.SetSizer(vbox)
         dialog.Fit()
+        result = dialog.ShowModal()
+        dialog.Destroy()
+        if result == wx.ID_APPLY:
+            self.start_live_mode(board, snapshot, edge_points)
+
+    def show_results_browser(self, board, snapshot, results, outline, on_deleted=None):
+        """分類結果の一覧。絞り込み・並べ替え・VIAへのズーム・選択した行の削除ができる
+
+        resultsは (分類コード, VIAのリスト) のリスト。行は表示される分だけ作るため、VIAが多くても開くのは速い。
+        選択した行を削除した場合は on_deleted(削除したVIAのリスト) で呼び出し元に通知する。
+        """
+        positions = {id(item): i for i, item in enumerate(snapshot.items)}
+        codes = {}
+        for code, vias in results:
+            for via in vias:
+                codes[positions[id(via)]] = code
+        table = ViaResultTable(snapshot, codes, self.outline_index(outline))
+        
+        dialog = wx.Dialog(None, title="VIAの一覧", size=(800, 600), style=wx.DEFAULT_DIALOG_STYLE | wx.RESIZE_BORDER)
+        vbox = wx.BoxSizer(wx.VERTICAL)
+        
+        # 絞り込みの条件
+        filter_box = wx.FlexGridSizer(cols=4, vgap=5, hgap=10)
+        chk_categories = {}
+        category_box = wx.BoxSizer(wx.HORIZONTAL)
+        for code, name in ViaResultTable.CATEGORY_NAMES.items():
+            chk_categories[code] = wx.CheckBox(dialog, label=name)
+            chk_categories[code].SetValue(True)
+            category_box.Add(chk_categories[code], flag=wx.RIGHT, border=10)
+        net_ctrl = wx.TextCtrl(dialog, style=wx.TE_PROCESS_ENTER)
+        min_ctrl = wx.TextCtrl(dialog, style=wx.TE_PROCESS_ENTER)
+        max_ctrl = wx.TextCtrl(dialog, style=wx.TE_PROCESS_ENTER)
+        distance_ctrl = wx.TextCtrl(dialog, style=wx.TE_PROCESS_ENTER)
+        filter_box.Add(wx.StaticText(dialog, label="分類:"), flag=wx.ALIGN_CENTER_VERTICAL)
+        filter_box.Add(category_box, flag=wx.ALIGN_CENTER_VERTICAL)
+        filter_box.Add(wx.StaticText(dialog, label="ネット（部分一致）:"), flag=wx.ALIGN_CENTER_VERTICAL)
+        filter_box.Add(net_ctrl, flag=wx.EXPAND)
+        filter_box.Add(wx.StaticText(dialog, label="直径の最小(mm):"), flag=wx.ALIGN_CENTER_VERTICAL)
+        filter_box.Add(min_ctrl, flag=wx.EXPAND)
+        filter_box.Add(wx.StaticText(dialog, label="直径の最大(mm):"), flag=wx.ALIGN_CENTER_VERTICAL)
+        filter_box.Add(max_ctrl, flag=wx.EXPAND)
+        filter_box.Add(wx.StaticText(dialog, label="外形線までの最大(mm):"), flag=wx.ALIGN_CENTER_VERTICAL)
+        filter_box.Add(distance_ctrl, flag=wx.EXPAND)
+        btn_filter = wx.Button(dialog, label="絞り込み")
+        filter_box.Add(btn_filter)
+        vbox.Add(filter_box, flag=wx.EXPAND | wx.ALL, border=10)
+        
+        count_text = wx.StaticText(dialog, label="")
+        vbox.Add(count_text, flag=wx.LEFT | wx.RIGHT, border=10)
+        list_ctrl = ViaListCtrl(dialog, table)
+        vbox.Add(list_ctrl, proportion=1, flag=wx.EXPAND | wx.ALL, border=10)
+        
+        btn_box = wx.BoxSizer(wx.HORIZONTAL)
+        btn_zoom = wx.Button(dialog, label="VIAへズーム")
+        btn_delete = wx.Button(dialog, label="選択した行のVIAを削除")
+        btn_delete.SetForegroundColour(wx.RED)
+        btn_close = wx.Button(dialog, wx.ID_CLOSE, "閉じる")
+        btn_box.Add(btn_zoom, flag=wx.RIGHT, border=5)
+        btn_box.Add(btn_delete, flag=wx.RIGHT, border=5)
+        btn_box.Add(btn_close, flag=wx.RIGHT, border=5)
+        vbox.Add(btn_box, flag=wx.ALIGN_CENTER | wx.ALL, border=10)
+        
+        def refresh():
+            list_ctrl.refresh_rows()
+            count_text.SetLabel(f"{len(table)}個 / {len(table.indices)}個のVIA")
+        
+        # 外形線までの距離をまとめて計算（多い場合は作業スレッドで、キャンセル可能）
+        def ensure_distances():
+            missing = table.missing_distances()
+            if len(missing) <= PROGRESS_CHUNK:
+                return table.compute_distances(missing)
+            return self.run_in_background("外形線までの距離を計算中...", lambda progress, cancel: table.compute_distances(
+                missing, lambda done, total: progress(100 * done // total, f"外形線までの距離を計算中... ({done}/{total})"),
+                cancel))
+        
+        def parse_mm(ctrl, label):
+            text = ctrl.GetValue().strip()
+            if not text:
+                return None
+            try:
+                return int(round(float(text) * 1000000))
+            except ValueError:
+                wx.MessageBox(f"{label}には数値（mm）を入力してください。", "警告", wx.ICON_WARNING)
+                raise
+        
+        def on_filter(evt):
+            try:
+                min_diameter = parse_mm(min_ctrl, "直径の最小")
+                max_diameter = parse_mm(max_ctrl, "直径の最大")
+                max_distance = parse_mm(distance_ctrl, "外形線までの最大")
+            except ValueError:
+                return
+            categories = set(code for code, chk in chk_categories.items() if chk.GetValue())
+            table.filter(categories, net_ctrl.GetValue().strip(), min_diameter, max_diameter, max_distance)
+            refresh()
+        
+        # 列の見出しをクリックすると並べ替え（同じ列をもう一度クリックすると逆順）
+        def on_column_click(evt):
+            column = table.COLUMNS[evt.GetColumn()][0]
+            if column == "distance" and not ensure_distances():
+                return
+            table.sort(column, table.sort_column == column and not table.sort_descending)
+            refresh()
+        
+        selection = [snapshot.items[i] for i in snapshot.indices(selected_only=True)]
+        
+        def on_zoom(evt):
+            rows = list_ctrl.selected_rows()
+            if not rows:
+                wx.MessageBox("一覧で行を選択してください。", "情報", wx.ICON_INFORMATION)
+                return
+            via = table.item(rows[0])
+            if hasattr(pcbnew, "FocusOnItem"):
+                pcbnew.FocusOnItem(via)
+            else:
+                # 前にズームしたVIAと開いた時に選択されていたVIAの選択を外し、このVIAだけを選択する
+                for item in selection:
+                    item.ClearSelected()
+                selection[:] = [via]
+                via.SetSelected()
+                pcbnew.Refresh()
+        
+        def on_delete(evt):
+            rows = list_ctrl.selected_rows()
+            if not rows:
+                wx.MessageBox("削除する行を選択してください。", "情報", wx.ICON_INFORMATION)
+                return
+            indices = [table.rows[row] for row in rows]
+            by_category = {VIA_INSIDE: [], VIA_OUTSIDE: [], VIA_OVERLAP: []}
+            for i in indices:
+                by_category[table.codes[i]].append(snapshot.items[i])
+            if self.delete_selected_vias(board, by_category[VIA_INSIDE], by_category[VIA_OUTSIDE],
+                                         by_category[VIA_OVERLAP]):
+                table.remove(indices)
+                for row in rows:
+                    list_ctrl.Select(row, on=0)
+                refresh()
+                if on_deleted is not None:
+                    on_deleted([snapshot.items[i] for i in indices])
+        
+        btn_filter.Bind(wx.EVT_BUTTON, on_filter)
+        for ctrl in (net_ctrl, min_ctrl, max_ctrl, distance_ctrl):
+            ctrl.Bind(wx.EVT_TEXT_ENTER, on_filter)
+        list_ctrl.Bind(wx.EVT_LIST_COL_CLICK, on_column_click)
+        list_ctrl.Bind(wx.EVT_LIST_ITEM_ACTIVATED, on_zoom)
+        btn_zoom.Bind(wx.EVT_BUTTON, on_zoom)
+        btn_delete.Bind(wx.EVT_BUTTON, on_delete)
+        btn_close.Bind(wx.EVT_BUTTON, lambda evt: dialog.EndModal(wx.ID_CLOSE))
+        
+        refresh()
+        dialog.SetSizer(vbox)
         dialog.ShowModal()
         dialog.Destroy()
 
-    def delete_selected_vias(self, board, inside_vias, outside_vias, overlap_vias):
-        """チェックボックスで選択されたVIAを削除"""
+    def start_live_mode(self, board, snapshot, outline):
+        """ライブモードを開始（実行中の場合は作り直す）"""
+        if self.live is not None:
+            self.live.frame.Close()  # 閉じる時に変更通知・タイマーも解除される
+        shapes, _debug_info = self.collect_edge_shapes(board)
+        self.live = LiveClassifier(self, board, snapshot.records(), outline, shapes)
+        self.live.start()
+
+    def delete_selected_vias(self, board, inside_vias, outside_vias, overlap_vias, close_vias=()):
+        """チェックボックスで選択されたVIAを削除（削除した場合はTrueを返す）"""
         all_selected_vias = []
         all_selected_vias.extend(inside_vias)
         all_selected_vias.extend(outside_vias)
         all_selected_vias.extend(overlap_vias)
+        # 近接・重複するVIAは内側・外側・重複のいずれかにも含まれるため、同じVIAを2回削除しない
+        listed = set(id(via) for via in all_selected_vias)
+        all_selected_vias.extend(via for via in close_vias if id(via) not in listed)
         
         if not all_selected_vias:
             wx.MessageBox("削除するVIAが選択されていません。", "情報", wx.ICON_INFORMATION)
-            return
+            return False
         
         info_str = ""
         if inside_vias:
@@ -597,19 +2838,396 @@ class ViaClassifierPlugin(pcbnew.ActionPlugin):
             info_str += f"外側: {len(outside_vias)}個 "
         if overlap_vias:
             info_str += f"重複: {len(overlap_vias)}個 "
+        if close_vias:
+            info_str += f"近接・重複: {len(close_vias)}個 "
             
         dlg = wx.MessageDialog(None, 
-                              f"選択された{len(all_selected_vias)}個のVIA ({info_str})を削除しますか？\nこの操作は元に戻せません。",
+                              f"選択された{len(all_selected_vias)}個のVIA ({info_str})を削除しますか？\n"
+                              "ツールを閉じた後、Ctrl+Zでまとめて元に戻せます。",
                               "削除の確認",
                               wx.YES_NO | wx.NO_DEFAULT | wx.ICON_WARNING)
         
+        deleted = False
         if dlg.ShowModal() == wx.ID_YES:
-            for via in all_selected_vias:
-                board.Remove(via)
-            pcbnew.Refresh()
+            with self.diagnostics.phase("delete"):
+                self.remove_vias(board, all_selected_vias)
+            self.diagnostics.count("vias_deleted", len(all_selected_vias))
             wx.MessageBox(f"{len(all_selected_vias)}個のVIAが削除されました。", "削除完了", wx.ICON_INFORMATION)
+            deleted = True
         
         dlg.Destroy()
+        return deleted
+
+    def remove_vias(self, board, vias):
+        """VIAをまとめて基板から削除
+
+        KiCadはアクションプラグインの実行全体を1つのコミットとして扱い、終了後に
+        接続情報の再構築・再描画と元に戻す（Ctrl+Z）の登録を1回だけ行う。
+        ここではVIAごとのリスナー通知を省くバルク削除モードを（使えるビルドなら）使い、再描画も最後に1回だけ行う。
+        """
+        # バルク削除ではVIAごとの変更通知が送られないため、この基板のライブモードが実行中なら直接伝える
+        if self.live is not None and self.live.is_same_board(board):
+            self.live.on_items_removed(vias)
+        if self.can_bulk_remove(board):
+            for via in vias:
+                board.Remove(via, pcbnew.REMOVE_MODE_BULK)
+            board.FinalizeBulkRemove(list(vias))
+        else:
+            for via in vias:
+                board.Remove(via)
+        pcbnew.Refresh()
+
+    def can_bulk_remove(self, board):
+        """バルク削除（REMOVE_MODE_BULK と FinalizeBulkRemove）が使えるかを、何も削除する前に確認
+
+        FinalizeBulkRemoveにリストを渡せないビルドでは、バルク削除すると接続情報とリスナーに
+        削除が伝わらないため、空のリストで呼べるかを試してから使う。
+        """
+        if not hasattr(pcbnew, "REMOVE_MODE_BULK") or not hasattr(board, "FinalizeBulkRemove"):
+            return False
+        try:
+            board.FinalizeBulkRemove([])
+        except TypeError:
+            return False
+        return True
+
+
+# 並列分類のワーカープロセスごとの状態（_init_parallel_workerで設定）
+_parallel_worker = {}
+
+
+def _init_parallel_worker(xs, ys, starts):
+    """並列分類のワーカープロセスの初期化: 外形線を受け取り、以降のチャンクで共有する"""
+    plugin = ViaClassifierPlugin()
+    plugin.parallel_workers = 1
+    _parallel_worker["plugin"] = plugin
+    _parallel_worker["outline"] = BoardOutline.from_arrays(xs, ys, starts)
+
+
+def _classify_parallel_chunk(positions, radii):
+    """ワーカープロセスで1チャンクを分類し、(分類コードのリスト, 調べた辺の数) を返す"""
+    plugin = _parallel_worker["plugin"]
+    edges_tested = plugin.diagnostics.counters.get("edges_tested", 0)
+    codes = plugin.classify_positions(positions, radii, _parallel_worker["outline"])
+    return codes, plugin.diagnostics.counters.get("edges_tested", 0) - edges_tested
+
+
+def _parse_sexpr(buffer, pos):
+    """bufferのposにある '(' から始まるS式を1つ読み、(入れ子のリスト, 終了位置) を返す"""
+    stack = []
+    current = None
+    match = SEXPR_TOKEN_PATTERN.match
+    while True:
+        token = match(buffer, pos)
+        if token is None:
+            raise ValueError(f"S式の解析に失敗しました（位置 {pos}）")
+        pos = token.end()
+        if token.group(1):
+            node = []
+            if current is not None:
+                current.append(node)
+                stack.append(current)
+            current = node
+        elif token.group(2):
+            if not stack:
+                return current, pos
+            current = stack.pop()
+        elif token.group(3) is not None:
+            current.append(token.group(3).decode("utf-8", "replace"))
+        else:
+            current.append(token.group(4).decode("utf-8", "replace"))
+
+
+def _sexpr_field(node, name):
+    """S式の子要素から先頭がnameのリストを探す"""
+    for child in node[1:]:
+        if isinstance(child, list) and child and child[0] == name:
+            return child
+    return None
+
+
+def _mm_to_iu(value):
+    """ファイル上のmm値をKiCadの内部単位（nm）に変換"""
+    return int(round(float(value) * 1000000))
+
+
+def _stream_shape_record(node, layer):
+    """gr_* 要素を collect_edge_shapes と同じ形式の図形タプルに変換"""
+    def point(name):
+        field = _sexpr_field(node, name)
+        return _mm_to_iu(field[1]), _mm_to_iu(field[2])
+    
+    kind = node[0]
+    if kind == "gr_line":
+        return ("segment", layer) + point("start") + point("end")
+    
+    if kind == "gr_rect":
+        return ("rect", layer) + point("start") + point("end")
+    
+    if kind == "gr_circle":
+        (cx, cy), (ex, ey) = point("center"), point("end")
+        return ("circle", layer, cx, cy, int(round(math.hypot(ex - cx, ey - cy))))
+    
+    if kind == "gr_poly":
+        coords = []
+        for child in _sexpr_field(node, "pts")[1:]:
+            if child[0] == "xy":
+                coords.extend((_mm_to_iu(child[1]), _mm_to_iu(child[2])))
+        return ("poly", layer) + tuple(coords)
+    
+    # gr_arc: 始点・中間点・終点から中心を求める
+    (ax, ay), (bx, by), (ex, ey) = point("start"), point("mid"), point("end")
+    d = 2 * (ax * (by - ey) + bx * (ey - ay) + ex * (ay - by))
+    if d == 0:
+        return ("segment", layer, ax, ay, ex, ey)
+    a_sq, b_sq, e_sq = ax * ax + ay * ay, bx * bx + by * by, ex * ex + ey * ey
+    cx = int(round((a_sq * (by - ey) + b_sq * (ey - ay) + e_sq * (ay - by)) / d))
+    cy = int(round((a_sq * (ex - bx) + b_sq * (ax - ex) + e_sq * (bx - ax)) / d))
+    
+    # 外形線の生成では始点から角度が増える向きに弧をたどるため、中間点を通らない向きなら入れ替える
+    start_angle = math.atan2(ay - cy, ax - cx)
+    to_mid = (math.atan2(by - cy, bx - cx) - start_angle) % (2 * math.pi)
+    to_end = (math.atan2(ey - cy, ex - cx) - start_angle) % (2 * math.pi)
+    if to_mid > to_end:
+        ax, ay, ex, ey = ex, ey, ax, ay
+    return ("arc", layer, ax, ay, ex, ey, cx, cy)
+
+
+def read_board_file(path):
+    """pcbnewを使わずに .kicad_pcb からVIAとEdge.Cutsの図形だけを読み込む
+
+    ファイルはメモリマップし、対象の要素以外は解析しない。
+    戻り値は (図形のリスト, (UUID, x, y, 幅) のVIAレコードのリスト, デバッグ情報)。
+    Edge.Cutsの未対応の図形（gr_curve）は collect_edge_shapes と同じく読み飛ばし、デバッグ情報に件数を出す。
+    """
+    shapes = []
+    records = []
+    edge_count = 0
+    unsupported = []
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # 空のファイルはメモリマップできない
+            buffer = b""
+        try:
+            end = 0
+            for item in STREAM_ITEM_PATTERN.finditer(buffer):
+                if item.start(1) < end:
+                    continue  # 直前に読んだ要素の内側
+                node, end = _parse_sexpr(buffer, item.start(1))
+                
+                if node[0] == "via":
+                    at = _sexpr_field(node, "at")
+                    uuid = _sexpr_field(node, "uuid") or _sexpr_field(node, "tstamp")
+                    records.append((uuid[1] if uuid else f"#{len(records)}",
+                                    _mm_to_iu(at[1]), _mm_to_iu(at[2]),
+                                    _mm_to_iu(_sexpr_field(node, "size")[1])))
+                    continue
+                
+                layer = _sexpr_field(node, "layer")
+                if layer is None or layer[1] != "Edge.Cuts":
+                    continue
+                edge_count += 1
+                if node[0] not in STREAM_SHAPE_KINDS:
+                    unsupported.append(node[0])
+                    continue
+                shapes.append(_stream_shape_record(node, layer[1]))
+        finally:
+            if isinstance(buffer, mmap.mmap):
+                buffer.close()
+    
+    debug_info = f"Edge.Cutsレイヤーの要素数: {edge_count}個\n"
+    if unsupported:
+        debug_info += f"未対応の形状タイプ: {len(unsupported)}個（{', '.join(sorted(set(unsupported)))}）\n"
+    return shapes, records, debug_info
+
+
+def classify_board_file(path, reader="pcbnew", workers=1, distance_field=DISTANCE_FIELD_ENABLED,
+                        native=NATIVE_ENGINE_ENABLED, regions=False, edge_clearance=None):
+    """基板ファイルを読み込んでVIAを分類し、結果のサマリー（辞書）を返す（wx不要）
+
+    readerが "stream" の場合はpcbnewで基板を読み込まず、read_board_file を使う。
+    workersが2以上でVIAが多い場合は、VIAをチャンクに分けてワーカープロセスで並列に分類する。
+    distance_fieldがTrueの場合は外形線の近くのVIAを符号付き距離場で判定する。
+    nativeがTrueの場合はpcbnewで読み込んだ基板のKiCadの基板外形で分類する。
+    regionsがTrueの場合は基板外形・縁からのクリアランス（edge_clearance、Noneなら設計ルールの値）・
+    キープアウト・コートヤードの各領域でも1回の走査で分類する（streamでは基板外形とクリアランスのみ）。
+    この場合は基板外形の分類もその走査の結果を使うため、distance_fieldは使われない。
+    """
+    summary = {"board": os.path.abspath(path), "status": "ok", "reader": reader}
+    board = None
+    try:
+        plugin = ViaClassifierPlugin()
+        plugin.parallel_workers = workers
+        plugin.parallel_processes = True
+        plugin.use_distance_field = distance_field
+        if reader == "stream":
+            with plugin.diagnostics.phase("read_board"):
+                shapes, records, debug_info = read_board_file(path)
+            chord_tolerance = plugin.chord_tolerance_for(width // 2 for _uuid, _x, _y, width in records)
+            edge_points, outline_debug_info = plugin.get_outline_from_shapes(shapes, None, chord_tolerance)
+            debug_info += outline_debug_info
+        else:
+            if pcbnew is None:
+                raise RuntimeError("pcbnewをインポートできません。--reader stream を使用してください。")
+            with plugin.diagnostics.phase("read_board"):
+                board = pcbnew.LoadBoard(path)
+            with plugin.diagnostics.phase("via_scan"):
+                records = ViaSnapshot.from_board(board).records()
+            chord_tolerance = plugin.chord_tolerance_for(width // 2 for _uuid, _x, _y, width in records)
+            outline = plugin.get_native_outline(board) if native else (None, "")
+            if outline[0] is not None:
+                edge_points, debug_info = outline[0].outline, outline[1]
+            else:
+                edge_points, debug_info = plugin.get_board_outline_debug(board, chord_tolerance)
+                debug_info = outline[1] + debug_info
+        summary["debug_info"] = debug_info
+        if not edge_points:
+            summary["status"] = "error"
+            summary["error"] = "基板の外形線が見つかりませんでした。"
+            return summary
+        
+        if regions or edge_clearance is not None:
+            # 基板外形は領域0として他の領域と同じ走査で分類し、VIAの分類結果もそこから取り出す
+            region_list, region_debug_info = plugin.reference_regions(
+                edge_points, board if regions else None, chord_tolerance, edge_clearance)
+            summary["debug_info"] += region_debug_info
+            masks = plugin.classify_regions(records, region_list)
+            summary["regions"] = []
+            for bit, region in enumerate(region_list):
+                region_codes = [region_code(mask, bit) for mask in masks]
+                summary["regions"].append({
+                    "name": region.name,
+                    "clearance": region.clearance,
+                    "inside": region_codes.count(VIA_INSIDE),
+                    "outside": region_codes.count(VIA_OUTSIDE),
+                    "overlap": region_codes.count(VIA_OVERLAP),
+                    "overlap_vias": [record[0] for record, code in zip(records, region_codes) if code == VIA_OVERLAP],
+                })
+                if bit == 0:
+                    codes = region_codes
+        else:
+            codes = plugin.classify_via_records(records, edge_points, complete=True)
+        summary["diagnostics"] = plugin.diagnostics.to_dict()
+        summary["outline_points"] = len(edge_points)
+        summary["outline_contours"] = edge_points.contour_count
+        summary["counts"] = {
+            "inside": codes.count(VIA_INSIDE),
+            "outside": codes.count(VIA_OUTSIDE),
+            "overlap": codes.count(VIA_OVERLAP),
+            "total": len(codes),
+        }
+        # 対処が必要な外側・重複のVIAは個別に出力
+        for name, category in (("outside", VIA_OUTSIDE), ("overlap", VIA_OVERLAP)):
+            summary[name] = [
+                {"uuid": uuid, "x": x, "y": y, "width": width}
+                for (uuid, x, y, width), code in zip(records, codes) if code == category
+            ]
+    except Exception as e:
+        summary["status"] = "error"
+        summary["error"] = str(e)
+        summary["traceback"] = traceback.format_exc()
+    return summary
+
+
+def _find_board_files(paths):
+    """ファイルとディレクトリ（再帰的に検索）から .kicad_pcb の一覧を作成"""
+    board_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _dirs, files in os.walk(path):
+                board_files.extend(os.path.join(root, name) for name in sorted(files) if name.endswith(".kicad_pcb"))
+        else:
+            board_files.append(path)
+    return board_files
+
+
+def _write_summary(summary, output_dir):
+    """サマリーを <基板名>.via-summary.json として書き出す"""
+    board_dir, board_name = os.path.split(summary["board"])
+    target_dir = output_dir or board_dir
+    os.makedirs(target_dir, exist_ok=True)
+    summary_path = os.path.join(target_dir, os.path.splitext(board_name)[0] + ".via-summary.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary_path
+
+
+def run_headless(paths, output_dir=None, workers=None, reader="pcbnew", distance_field=DISTANCE_FIELD_ENABLED,
+                 native=NATIVE_ENGINE_ENABLED, regions=False, edge_clearance=None):
+    """複数の基板をプロセスプールで並列に分類し、基板ごとにサマリーを書き出す
+
+    基板の数がワーカー数より少ない場合は、余ったワーカーを各基板のVIAの並列分類に割り当てる。
+    """
+    workers = workers or os.cpu_count() or 1
+    board_workers = min(workers, len(paths))
+    chunk_workers = max(1, workers // board_workers)
+    summaries = {}
+    crashed = []
+    with ProcessPoolExecutor(max_workers=board_workers) as executor:
+        futures = {executor.submit(classify_board_file, path, reader, chunk_workers, distance_field,
+                                   native, regions, edge_clearance): path for path in paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summaries[path] = future.result()
+            except BrokenProcessPool:
+                crashed.append(path)
+    
+    # ワーカーが異常終了した場合は、原因の基板を特定するため1枚ずつ別プロセスで再実行
+    for path in crashed:
+        try:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                summaries[path] = executor.submit(classify_board_file, path, reader, chunk_workers, distance_field,
+                                                native, regions, edge_clearance).result()
+        except BrokenProcessPool:
+            summaries[path] = {"board": os.path.abspath(path), "status": "error",
+                               "error": "ワーカープロセスが異常終了しました。"}
+    
+    results = []
+    for path in paths:
+        summary = summaries[path]
+        summary_path = _write_summary(summary, output_dir)
+        if summary["status"] == "ok":
+            counts = summary["counts"]
+            print(f"{path}: 内側={counts['inside']} 外側={counts['outside']} 重複={counts['overlap']} -> {summary_path}")
+            for region in summary.get("regions", []):
+                print(f"  {region['name']}: 内側={region['inside']} 外側={region['outside']} 重複={region['overlap']}")
+        else:
+            print(f"{path}: エラー: {summary['error']} -> {summary_path}", file=sys.stderr)
+        results.append(summary)
+    return results
+
+
+def main(argv=None):
+    """コマンドラインからの一括分類"""
+    parser = argparse.ArgumentParser(description="基板外形線を基準にVIAを内側/外側/重複に分類します（ヘッドレス）")
+    parser.add_argument("paths", nargs="+", help=".kicad_pcb ファイル、またはそれを含むディレクトリ")
+    parser.add_argument("-o", "--output-dir", help="サマリーの出力先（省略時は基板ファイルと同じディレクトリ）")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="ワーカープロセス数（省略時はCPUコア数）")
+    parser.add_argument("--reader", choices=("pcbnew", "stream"), default="pcbnew" if pcbnew is not None else "stream",
+                        help="基板の読込方法（stream: pcbnewを使わずVIAとEdge.Cutsだけを読む）")
+    parser.add_argument("--distance-field", action="store_true", default=DISTANCE_FIELD_ENABLED,
+                        help="外形線の近くのVIAを符号付き距離場で判定する")
+    parser.add_argument("--native", action="store_true", default=NATIVE_ENGINE_ENABLED,
+                        help="KiCadの基板外形（SHAPE_POLY_SET）で分類する（--reader pcbnew のみ）")
+    parser.add_argument("--regions", action="store_true",
+                        help="キープアウト・コートヤード・縁からのクリアランスの領域でも分類する（streamでは縁のクリアランスのみ）")
+    parser.add_argument("--edge-clearance", type=float, default=None,
+                        help="縁からのクリアランス（mm、省略時は基板の設計ルールの値）")
+    args = parser.parse_args(argv)
+    edge_clearance = None if args.edge_clearance is None else int(round(args.edge_clearance * 1000000))
+    
+    board_files = _find_board_files(args.paths)
+    if not board_files:
+        parser.error("基板ファイルが見つかりませんでした。")
+    results = run_headless(board_files, args.output_dir, args.jobs, args.reader, args.distance_field,
+                           args.native, args.regions, edge_clearance)
+    return 0 if all(summary["status"] == "ok" for summary in results) else 1
+
 
-# プラグインを登録
-ViaClassifierPlugin().register()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
+elif __name__ != "__mp_main__" and pcbnew is not None:
+    # プラグインを登録
+    ViaClassifierPlugin().register()
\ No newline at end of file